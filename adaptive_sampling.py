@@ -0,0 +1,163 @@
+import sqlite3
+import zlib
+from capture_traffic import list_of_attributes_to_add
+from flow_table import extract_flow_fields, parse_int
+from pipeline_metrics import increment, set_gauge
+from sqlite_connection import PacketInfoWriter, attributes, create_packet_info_table, map_attributes_order, packet_to_row
+
+
+# How packets are picked while sampling. `'count'` keeps every Nth packet, `'flow'` keeps every packet of 1 in N flows.
+SAMPLING_MODES = ('count', 'flow')
+
+# Columns of packet_info when packets are sampled. A row stands for `sampling_rate` packets.
+sampled_attributes = {**attributes, 'sampling_rate': 'INT'}
+
+# The attribute every sampled record is tagged with, in the column order of `sampled_attributes`
+SAMPLING_ATTRIBUTE = 'sampling.rate'
+
+
+def flow_hash(packet) -> int | None:
+    """
+    Hashes the 5-tuple of a packet the same way for both directions of a connection, so a flow is either kept or shed as a whole. Returns `None` for packets without a flow (Exp: ARP).
+    """
+    flow_fields = extract_flow_fields(packet)
+    if flow_fields is None:
+        return None
+    src_ip, dest_ip, src_port, dest_port, proto = flow_fields[0]
+    endpoints = sorted([(str(src_ip), src_port), (str(dest_ip), dest_port)])
+    return zlib.crc32(repr((endpoints, proto)).encode())
+
+
+class AdaptiveSampler:
+    """
+    Sheds load when the extraction and insert loop falls behind the capture. While the backlog is small every packet is decoded. Once it passes `high_watermark` the sampling rate doubles, up to `max_rate`, and once it drops under `low_watermark` the rate halves until every packet is decoded again. Every packet is counted in the summary stats, whether it is decoded or not.
+
+    Rates are powers of two, so in `'flow'` mode the flows kept at a rate are also kept at every lower rate and flows are not cut in half when the rate changes.
+
+    Only the async captures of `async_capture` have a backlog to sample on. The sync `live_capture()` and `remote_capture()` sniff every packet before any of them is decoded, so they are not sampled.
+
+    Parameters:
+    - `mode` (str): One of `SAMPLING_MODES`.
+    - `high_watermark` (float): How full the backlog (0 to 1) has to be before the rate goes up.
+    - `low_watermark` (float): How empty the backlog has to be before the rate goes down.
+    - `max_rate` (int): The highest rate. Exp: `1024` keeps at least 1 in 1024 packets.
+    - `check_interval` (int): The number of packets between rate changes, so the rate follows the backlog instead of every single packet.
+
+    Example:
+    - `async_live_capture('eth0', osi_layers, attributes, sampler=AdaptiveSampler(mode='flow'))`
+    """
+    def __init__(self, mode: str = 'count', high_watermark: float = 0.5, low_watermark: float = 0.1, max_rate: int = 1024, check_interval: int = 100) -> None:
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f'Unknown sampling mode {mode}, expected one of {SAMPLING_MODES}')
+        self.mode = mode
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_rate = max_rate
+        self.check_interval = check_interval
+        self.rate = 1
+        self.packets = 0
+        self.bytes = 0
+        self.sampled = 0
+        self.shed = 0
+        self.rate_changes = 0
+        self.packets_by_rate = {}
+
+
+    def adjust(self, backlog: float) -> int:
+        """
+        Moves the rate one step up or down from the backlog.
+
+        Parameters:
+        - `backlog` (float): How full the queue to the consumer is, from 0 to 1.
+
+        Returns:
+        - `int`: The new rate.
+        """
+        rate = self.rate
+        if backlog >= self.high_watermark and rate < self.max_rate:
+            rate = min(rate * 2, self.max_rate)
+        elif backlog <= self.low_watermark and rate > 1:
+            rate //= 2
+        if rate != self.rate:
+            self.rate = rate
+            self.rate_changes += 1
+            set_gauge('sampling.rate', rate)
+        return rate
+
+
+    def keep(self, packet, backlog: float) -> int:
+        """
+        Counts a packet and decides if it is decoded.
+
+        Parameters:
+        - `packet`: The pyshark packet.
+        - `backlog` (float): How full the queue to the consumer is, from 0 to 1.
+
+        Returns:
+        - `int`: The rate the packet was kept at, or `0` if it was shed.
+        """
+        self.packets += 1
+        self.bytes += parse_int(getattr(packet, 'length', 0))
+        if self.packets % self.check_interval == 0:
+            self.adjust(backlog)
+        self.packets_by_rate[self.rate] = self.packets_by_rate.get(self.rate, 0) + 1
+
+        kept = self.rate == 1
+        if not kept and self.mode == 'flow':
+            packet_hash = flow_hash(packet)
+            kept = packet_hash % self.rate == 0 if packet_hash is not None else self.packets % self.rate == 0
+        elif not kept:
+            kept = self.packets % self.rate == 0
+
+        if kept:
+            self.sampled += 1
+            return self.rate
+        self.shed += 1
+        increment('sampling.shed')
+        return 0
+
+
+    def as_dict(self) -> dict:
+        return {'packets': self.packets, 'bytes': self.bytes, 'sampled': self.sampled, 'shed': self.shed, 'rate': self.rate, 'rate_changes': self.rate_changes, 'packets_by_rate': dict(self.packets_by_rate)}
+
+
+async def store_sampled_stream(connection: sqlite3.Connection, packet_stream, attributes_to_add: list | tuple = list_of_attributes_to_add, columns: dict = sampled_attributes, **kwargs) -> int:
+    """
+    Inserts the packets of a sampled async packet stream into `packet_info` together with the rate each one was kept at.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `packet_stream`: An async iterable of `('Packet N', packet_data)` tuples. Exp: `async_capture.async_live_capture(..., sampler=AdaptiveSampler())`.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns, without the sampling rate.
+    - `columns` (dict): The columns of the `packet_info` table. The last one stores the sampling rate.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`.
+
+    Returns:
+    - `int`: The number of rows that were inserted.
+
+    Example:
+    - `asyncio.run(store_sampled_stream(connection, async_live_capture('eth0', instantiate_all_osi_layers(), list_of_attributes_to_add, sampler=sampler)))`
+    """
+    create_packet_info_table(connection, columns)
+    mapping_attributes_order = map_attributes_order(list(attributes_to_add) + [SAMPLING_ATTRIBUTE])
+    with PacketInfoWriter(connection, columns, **kwargs) as writer:
+        async for packet_key_name, packet_data in packet_stream:
+            row = packet_to_row(packet_data, mapping_attributes_order, len(columns))
+            if row[-1] is None:
+                row[-1] = 1
+            writer.add_row(row)
+    return writer.rows_written
+
+
+def estimate_packet_count(connection: sqlite3.Connection, where: str = '1', parameters: tuple = (), table_name: str = 'packet_info') -> int:
+    """
+    Scales the sampled rows back to the number of packets they stand for, by adding up their sampling rates. Packets the async capture dropped after they were sampled are part of the rate of a stored row, so they are counted as well.
+
+    Parameters:
+    - `where` (str): The `WHERE` clause with `?` placeholders. Exp: `'dest_port = ?'`.
+    - `parameters` (tuple): The values of the placeholders.
+
+    Returns:
+    - `int`: The estimated number of captured packets that match.
+    """
+    return connection.execute(f'SELECT COALESCE(SUM(sampling_rate), 0) FROM {table_name} WHERE {where}', parameters).fetchone()[0]
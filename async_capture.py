@@ -0,0 +1,157 @@
+import asyncio
+from pipeline_metrics import increment, set_gauge
+from capture_traffic_functions import extract_packet_attributes, modify_keys_packet_dict, grab_packet_attributes
+
+
+# What to do with a new packet when the queue to the consumer is full
+DROP_POLICIES = ('drop_newest', 'drop_oldest')
+
+
+class CaptureCounters:
+    """
+    Counters for an async capture. Exp: `counters.dropped` is the number of packets that were dropped because the consumer fell behind.
+    """
+    def __init__(self) -> None:
+        self.captured = 0
+        self.dropped = 0
+        self.yielded = 0
+        self.max_queue_depth = 0
+
+
+    def as_dict(self) -> dict:
+        return {'captured': self.captured, 'dropped': self.dropped, 'yielded': self.yielded, 'max_queue_depth': self.max_queue_depth}
+
+
+def check_queue_options(queue_size: int, drop_policy: str) -> None:
+    """
+    Raises a `ValueError` for queue options the async captures can not work with. The capture helpers call it before starting tshark, since an async generator only runs its checks on the first iteration.
+    """
+    if drop_policy not in DROP_POLICIES:
+        raise ValueError(f'Unknown drop policy {drop_policy}, expected one of {DROP_POLICIES}')
+    if queue_size < 1:
+        raise ValueError(f'queue_size must be at least 1, got {queue_size}')
+
+
+async def async_stream_attributes(capture_interface, osi_layers: dict, search_for_iterable: list|tuple|set, num_packets: int | None = None, queue_size: int = 1000, drop_policy: str = 'drop_newest', counters: CaptureCounters | None = None, sampler=None):
+    """
+    Async version of `capture_traffic_functions.stream_attributes()`. Packets are read from tshark on the running event loop and handed to the consumer through a bounded queue.
+
+    Parameters:
+    - `capture_interface`: A pyshark capture object that has not been sniffed yet.
+    - `osi_layers` (dict): The dict returned from the `instantiate_osi_layers()`.
+    - `search_for_iterable`: An interable that contains the attribute values to only grab from.
+    - `num_packets` (int | None): The number of packets to capture. `None` captures until the consumer stops.
+    - `queue_size` (int): The number of packets that can wait for the consumer. At least 1, since `asyncio.Queue` treats 0 as unbounded and the sampler divides by it.
+    - `drop_policy` (str): One of `DROP_POLICIES`. `'drop_newest'` drops the packet that was just captured, `'drop_oldest'` drops the packet that has waited the longest.
+    - `counters` (CaptureCounters | None): Counters that are updated while capturing. Pass one in to read the dropped packets.
+    - `sampler` (AdaptiveSampler | None): Decides which packets are decoded from how full the queue is. Exp: `adaptive_sampling.AdaptiveSampler()`. `None` decodes every packet that fits in the queue.
+
+    Returns:
+    - An async generator that yields `('Packet N', packet_data)` tuples, the same as `stream_attributes()`. `N` is the number of the captured packet, so dropped packets leave gaps. With a sampler, `packet_data['sampling']` holds the number of captured packets the packet stands for: the rate it was kept at, plus the rates of kept packets the full queue dropped in its place. So `adaptive_sampling.estimate_packet_count()` still adds up to every captured packet.
+
+    Note:
+    - pyshark hands packets to a synchronous callback, so the capture can not be paused when the consumer falls behind. tshark keeps reading from the interface either way, so packets are dropped here where they are counted instead of in the tshark buffers where they are lost silently.
+    """
+    check_queue_options(queue_size, drop_policy)
+    counters = counters if counters is not None else CaptureCounters()
+    queue = asyncio.Queue(maxsize=queue_size)
+    # Queued items are `[packet_num, packet, sampling_rate]` lists, so the rate of a dropped packet can be added to a queued one
+    newest_item = None
+
+    def queue_packet(packet) -> None:
+        nonlocal newest_item
+        counters.captured += 1
+        sampling_rate = None
+        if sampler is not None:
+            sampling_rate = sampler.keep(packet, queue.qsize() / queue_size)
+            if not sampling_rate:
+                return
+        if queue.full():
+            counters.dropped += 1
+            increment('async_capture.dropped')
+            if drop_policy == 'drop_newest':
+                if sampling_rate is not None:
+                    newest_item[2] += sampling_rate
+                return
+            dropped_item = queue.get_nowait()
+            if sampling_rate is not None:
+                sampling_rate += dropped_item[2]
+        newest_item = [counters.captured, packet, sampling_rate]
+        queue.put_nowait(newest_item)
+        counters.max_queue_depth = max(counters.max_queue_depth, queue.qsize())
+        set_gauge('async_capture.queue_depth', queue.qsize())
+
+    producer = asyncio.ensure_future(capture_interface.packets_from_tshark(queue_packet, packet_count=num_packets))
+    try:
+        while not (producer.done() and queue.empty()):
+            next_packet = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait({next_packet, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if next_packet not in done:
+                next_packet.cancel()
+                continue
+            packet_num, packet, sampling_rate = next_packet.result()
+            packet_data = grab_packet_attributes(modify_keys_packet_dict(extract_packet_attributes(packet, osi_layers)), search_for_iterable)
+            if sampling_rate is not None:
+                packet_data['sampling'] = {'sampling.rate': sampling_rate}
+            counters.yielded += 1
+            yield f'Packet {packet_num}', packet_data
+        producer.result()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+
+def async_live_capture(interface: str, osi_layers: dict, search_for_iterable: list|tuple|set, num_packets: int | None = None, queue_size: int = 1000, drop_policy: str = 'drop_newest', counters: CaptureCounters | None = None, sampler=None, **kwargs):
+    """
+    Async generator version of `live_capture()`.
+
+    Parameters:
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.LiveCapture`.
+    - The other parameters are the same as `async_stream_attributes()`.
+
+    Example:
+    - `async for packet_key_name, packet_data in async_live_capture('Ethernet 2', osi_layers, list_of_attributes_to_add): ...`
+    """
+    import pyshark
+
+    check_queue_options(queue_size, drop_policy)
+    capture = pyshark.LiveCapture(interface=interface, **kwargs)
+    return async_stream_attributes(capture, osi_layers, search_for_iterable, num_packets, queue_size, drop_policy, counters, sampler)
+
+
+def async_remote_capture(remote_host: str, remote_interface: str, osi_layers: dict, search_for_iterable: list|tuple|set, num_packets: int | None = None, queue_size: int = 1000, drop_policy: str = 'drop_newest', counters: CaptureCounters | None = None, sampler=None, **kwargs):
+    """
+    Async generator version of `remote_capture()`.
+
+    Parameters:
+    - `remote_host` (str): A remote host to capture traffic from.
+    - `remote_interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.RemoteCapture`.
+    - The other parameters are the same as `async_stream_attributes()`.
+    """
+    import pyshark
+
+    check_queue_options(queue_size, drop_policy)
+    capture = pyshark.RemoteCapture(remote_host=remote_host, remote_interface=remote_interface, **kwargs)
+    return async_stream_attributes(capture, osi_layers, search_for_iterable, num_packets, queue_size, drop_policy, counters, sampler)
+
+
+def async_live_ring_capture(interface: str, osi_layers: dict, search_for_iterable: list|tuple|set, num_packets: int | None = None, queue_size: int = 1000, drop_policy: str = 'drop_newest', counters: CaptureCounters | None = None, sampler=None, **kwargs):
+    """
+    Async generator version of `live_ring_capture()`.
+
+    Parameters:
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.LiveRingCapture`.
+    - The other parameters are the same as `async_stream_attributes()`.
+    """
+    import pyshark
+
+    check_queue_options(queue_size, drop_policy)
+    capture = pyshark.LiveRingCapture(interface=interface, **kwargs)
+    return async_stream_attributes(capture, osi_layers, search_for_iterable, num_packets, queue_size, drop_policy, counters, sampler)
@@ -0,0 +1,200 @@
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from capture_traffic import list_of_attributes_to_add
+from capture_traffic_functions import instantiate_all_osi_layers, get_layer_info, get_layer_attributes, reformat_attributes_dict, modify_keys_attribute_dict, only_grab_specific_attributes
+from packet_classes import PacketStore, retrieve_packet
+from sqlite_connection import create_packet_info_table, store_packets
+from synthetic_pcap import write_synthetic_pcap
+
+
+def peak_rss_kb() -> int | None:
+    """
+    Returns the peak resident set size of the process in kilobytes. `resource` only exists on Unix, so on Windows the peak working set from `psutil` is used when it is installed, otherwise `None` is returned.
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss) // 1024
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def legacy_extract_substring(iterable, identifier: str) -> str:
+    new_substring = str()
+    for char in iterable:
+        if char != identifier:
+            new_substring += char
+        else:
+            break
+    return new_substring
+
+
+def legacy_modify_keys_attribute_dict(attribute_dict: dict) -> dict:
+    """
+    The key renaming `modify_keys_attribute_dict()` used before it was memoized, kept so the benchmark can time both on the same capture. It rewrites the dicts in place with `+=` prefix extraction and `str.replace`.
+    """
+    for packet_data in attribute_dict.values():
+        for key, value in packet_data.items():
+            if value != None:
+                for inner_key in list(packet_data[key]):
+                    extracted_val = legacy_extract_substring(inner_key, '.')
+                    new_dict_name = inner_key.replace(extracted_val, f'{key}')
+                    packet_data[key][new_dict_name] = packet_data[key].pop(inner_key)
+    return attribute_dict
+
+
+@contextmanager
+def timed_stage(stages: dict, name: str):
+    """
+    Times a stage of the pipeline and stores the seconds it took and the peak RSS after it in `stages[name]`.
+    """
+    start_time = time.perf_counter()
+    yield
+    stages[name] = {'seconds': time.perf_counter() - start_time, 'peak_rss_kb': peak_rss_kb()}
+
+
+def run_benchmark(pcap_path: str, attributes_to_add: list | tuple = list_of_attributes_to_add, **kwargs) -> dict:
+    """
+    Runs each stage of the pipeline over a capture file and times it.
+
+    Parameters:
+    - `pcap_path` (str): The capture file to read. Exp: a file written by `synthetic_pcap.write_synthetic_pcap()`.
+    - `attributes_to_add` (list | tuple): The attributes to keep.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture`.
+
+    Returns:
+    - `dict`: The number of packets, the timings of each stage and the peak RSS of the process. `comparisons` holds the seconds of the legacy and current version of a stage that was rewritten for speed, and the speedup between them. Exp: `report['comparisons']['modify_keys_attribute_dict']['speedup']`.
+    """
+    import pyshark
+
+    stages = {}
+    capture = pyshark.FileCapture(input_file=pcap_path, **kwargs)
+    try:
+        with timed_stage(stages, 'tshark_decode'):
+            capture.load_packets()
+
+        with timed_stage(stages, 'retrieve_packet'):
+            retrieve_packet(capture)
+
+        with timed_stage(stages, 'packet_store'):
+            packet_store = PacketStore(capture)
+
+        layer_info = {}
+        for layer_name, layer in instantiate_all_osi_layers().items():
+            with timed_stage(stages, f'{layer_name}_construction'):
+                layer_info[layer_name] = get_layer_info(layer, packet_store)
+
+        with timed_stage(stages, 'retrieve_attribute_from_layer'):
+            layer_attributes = {layer_name: get_layer_attributes(layer, layer.get_packet_layer()) for layer_name, layer in layer_info.items()}
+
+        combine_dict = {}
+        for i in range(len(packet_store)):
+            packet_key_name = f'Packet {i + 1}'
+            combine_dict[packet_key_name] = {}
+            for name in layer_attributes:
+                reformat_attributes_dict(combine_dict, packet_key_name, name, layer_attributes[name])
+
+        # The legacy renaming changes the dicts in place, so it gets its own copy of the same packets
+        legacy_combine_dict = {packet_key_name: {layer_name: dict(layer_value) if layer_value is not None else None for layer_name, layer_value in packet_data.items()} for packet_key_name, packet_data in combine_dict.items()}
+        with timed_stage(stages, 'modify_keys_attribute_dict_legacy'):
+            legacy_modify_keys_attribute_dict(legacy_combine_dict)
+
+        with timed_stage(stages, 'modify_keys_attribute_dict'):
+            combine_dict = modify_keys_attribute_dict(combine_dict)
+        comparisons = {'modify_keys_attribute_dict': compare_stages(stages['modify_keys_attribute_dict_legacy'], stages['modify_keys_attribute_dict'])}
+
+        with timed_stage(stages, 'only_grab_specific_attributes'):
+            combine_dict = only_grab_specific_attributes(combine_dict, attributes_to_add)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            connection = sqlite3.connect(os.path.join(temp_dir, 'packet_storage.db'))
+            create_packet_info_table(connection)
+            with timed_stage(stages, 'sqlite_insert'):
+                store_packets(connection, combine_dict, attributes_to_add)
+            connection.close()
+    finally:
+        capture.close()
+
+    num_packets = len(packet_store)
+    for stage in stages.values():
+        stage['packets_per_second'] = num_packets / stage['seconds'] if stage['seconds'] > 0 else 0.0
+    return {'pcap': pcap_path, 'packets': num_packets, 'stages': stages, 'comparisons': comparisons, 'peak_rss_kb': peak_rss_kb()}
+
+
+def compare_stages(legacy_stage: dict, stage: dict) -> dict:
+    """
+    Compares the timings of the legacy and current version of a stage.
+
+    Returns:
+    - `dict`: Exp: `{'legacy_seconds': 2.4, 'seconds': 0.8, 'speedup': 3.0}`.
+    """
+    return {'legacy_seconds': legacy_stage['seconds'], 'seconds': stage['seconds'], 'speedup': legacy_stage['seconds'] / stage['seconds'] if stage['seconds'] > 0 else 0.0}
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float = 0.2) -> list[dict]:
+    """
+    Compares a report with a baseline report from an earlier run.
+
+    Parameters:
+    - `report` (dict): The dict returned from the `run_benchmark()`.
+    - `baseline` (dict): A report from an earlier run. Exp: loaded from the `--output` file of a previous commit.
+    - `tolerance` (float): How much slower a stage can be before it counts as a regression. Exp: `0.2` is 20%.
+
+    Returns:
+    - `list`: The stages whose packets per second dropped by more than the tolerance.
+    """
+    regressions = []
+    for name, stage in report['stages'].items():
+        baseline_stage = baseline.get('stages', {}).get(name)
+        if baseline_stage and stage['packets_per_second'] < baseline_stage['packets_per_second'] * (1 - tolerance):
+            regressions.append({'stage': name, 'packets_per_second': stage['packets_per_second'], 'baseline_packets_per_second': baseline_stage['packets_per_second']})
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline over a deterministic synthetic pcap and print the results as JSON.')
+    parser.add_argument('--packets', type=int, default=10000, help='The number of packets in the synthetic pcap.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the synthetic pcap.')
+    parser.add_argument('--pcap', help='Benchmark an existing capture file instead of a synthetic one.')
+    parser.add_argument('--output', help='Write the JSON report to a file instead of stdout.')
+    parser.add_argument('--baseline', help='A JSON report from an earlier run. Exits with status 1 if a stage regressed.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='How much slower a stage can be than the baseline before it counts as a regression.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pcap_path = args.pcap
+        if pcap_path is None:
+            pcap_path = os.path.join(temp_dir, f'synthetic_{args.packets}_{args.seed}.pcap')
+            write_synthetic_pcap(pcap_path, args.packets, args.seed)
+        report = run_benchmark(pcap_path)
+        report.update({'seed': args.seed, 'synthetic': args.pcap is None})
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report['regressions'] = find_regressions(report, json.load(baseline_file), args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
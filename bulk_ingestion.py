@@ -0,0 +1,86 @@
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import time
+from capture_traffic_functions import instantiate_all_osi_layers, stream_attributes
+from packet_records import PacketRecords
+
+
+def find_capture_files(path: str, extensions: tuple = ('.pcap', '.pcapng', '.cap')) -> list[str]:
+    """
+    Finds the capture files to ingest.
+
+    Parameters:
+    - `path` (str): A directory, a glob pattern or a single file. Exp: `'captures/*.pcapng'`.
+    - `extensions` (tuple): The file extensions that are picked up when `path` is a directory.
+
+    Returns:
+    - `list`: The capture files sorted by path, so that the ingestion order is deterministic.
+    """
+    if os.path.isdir(path):
+        file_paths = [os.path.join(path, file_name) for file_name in os.listdir(path) if file_name.endswith(extensions)]
+    else:
+        file_paths = glob.glob(path)
+    return sorted(file_path for file_path in file_paths if os.path.isfile(file_path))
+
+
+def ingest_capture_file(file_path: str, attributes: list | tuple, capture_kwargs: dict | None = None) -> tuple[str, PacketRecords, float]:
+    """
+    Runs the layer extraction from `packet_classes` over a single capture file. Used as the worker of `bulk_ingest()`, each worker has its own `pyshark.FileCapture`.
+
+    Parameters:
+    - `file_path` (str): The capture file to read.
+    - `attributes` (list | tuple): The attributes to keep. Exp: `list_of_attributes_to_add`.
+    - `capture_kwargs` (dict | None): Additional keyword arguments passed to `pyshark.FileCapture`.
+
+    Returns:
+    - `tuple`: The file path, the `PacketRecords` of the file and the number of seconds it took.
+    """
+    import pyshark
+
+    start_time = time.perf_counter()
+    capture = pyshark.FileCapture(input_file=file_path, keep_packets=False, **(capture_kwargs or {}))
+    records = PacketRecords(attributes)
+    try:
+        for packet_key_name, packet_data in stream_attributes(capture, instantiate_all_osi_layers(), attributes):
+            records.append(packet_data)
+    finally:
+        capture.close()
+    return file_path, records, time.perf_counter() - start_time
+
+
+def bulk_ingest(path: str, attributes: list | tuple, max_workers: int | None = None, **kwargs) -> tuple[PacketRecords, list[dict]]:
+    """
+    Ingests every capture file in a directory or glob with a process pool, one file per worker.
+
+    Parameters:
+    - `path` (str): A directory, a glob pattern or a single file. Exp: `'captures/'`.
+    - `attributes` (list | tuple): The attributes to keep. Exp: `list_of_attributes_to_add`.
+    - `max_workers` (int | None): The number of worker processes. Defaults to the number of cores.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture`.
+
+    Returns:
+    - `tuple`: The merged `PacketRecords` and a report with the timings of each file. The packets are merged in the sorted order of the files, no matter which worker finishes first. A file that fails (Exp: a truncated pcap) is reported with its `error` and left out of the records, the other files are still ingested.
+
+    Example:
+    - `records, report = bulk_ingest('captures/*.pcap', list_of_attributes_to_add, max_workers=8)`
+    """
+    file_paths = find_capture_files(path)
+    packet_records = PacketRecords(attributes)
+    report = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(ingest_capture_file, file_path, attributes, kwargs) for file_path in file_paths]
+        for file_path, future in zip(file_paths, futures):
+            try:
+                file_path, records, seconds = future.result()
+            except Exception as error:
+                report.append({'file': file_path, 'packets': 0, 'seconds': 0.0, 'packets_per_second': 0.0, 'error': repr(error)})
+                continue
+            packet_records.extend(records)
+            report.append({'file': file_path,
+                           'packets': len(records),
+                           'seconds': seconds,
+                           'packets_per_second': len(records) / seconds if seconds > 0 else 0.0,
+                           'error': None
+                           })
+    return packet_records, report
@@ -1,26 +1,90 @@
-from capture_traffic_functions import live_capture, instantiate_osi_layers, get_layer_info, get_layer_attributes, reformat_attributes_dict, modify_keys_attribute_dict, only_grab_specific_attributes
-from packet_classes import PhysicalLayer, DataLinkLayer, NetworkLayer, TransportLayer, SessionLayer, PresentationLayer, ApplicationLayer
+import argparse
+from capture_traffic_functions import live_capture, build_capture_filter_kwargs, instantiate_all_osi_layers, get_layer_info, get_layer_attributes, reformat_attributes_dict, modify_keys_attribute_dict, only_grab_specific_attributes, stream_attributes
+from packet_classes import PacketStore
+from packet_records import PacketRecords
 from pprint import pprint
 
 
-live_traffic = live_capture(interface='Ethernet 2', num_packets=2, encryption_type='wpa-pwk')
+list_of_attributes_to_add = ['datalink_layer.src', 'datalink_layer.dst', 'network_layer.src', 'network_layer.dst', 'transport_layer.srcport', 'transport_layer.dstport']
 
-osi_layers = instantiate_osi_layers(physical_layer=PhysicalLayer(), datalink_layer=DataLinkLayer(), network_layer=NetworkLayer(), transport_layer=TransportLayer(), session_layer=SessionLayer(), presentation_layer=PresentationLayer(), application_layer=ApplicationLayer())
 
-layer_info = {layer_name: get_layer_info(layer, live_traffic) for layer_name, layer in osi_layers.items()}
+def capture_packets(interface: str = 'Ethernet 2', num_packets: int = 2, attributes_to_add: list | tuple = list_of_attributes_to_add, **kwargs) -> dict:
+    """
+    Captures live traffic and runs it through the whole pipeline: layer extraction, key renaming and attribute filtering.
 
-layer_attributes = {layer_name: get_layer_attributes(layer, layer.get_packet_layer()) for layer_name, layer in layer_info.items()}
+    Parameters:
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `num_packets` (int): specifying the number of packets to capture from the interface.
+    - `attributes_to_add` (list | tuple): The attributes to keep. Exp: `list_of_attributes_to_add`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.LiveCapture`. Exp: `encryption_type='wpa-pwk'`.
 
-combine_dict = {}
-for i in range(len(live_traffic)):
-    packet_key_name = f'Packet {i + 1}'
-    combine_dict[packet_key_name] = {}
-    for name in layer_attributes:
-        reformat_attributes_dict(combine_dict, packet_key_name, name, layer_attributes[name])
+    Returns:
+    - `dict`: The `combine_dict` where each packet only has the requested attributes. Exp: `combine_dict['Packet 1']['network_layer']['network_layer.src']`. The capture timestamp and frame length are under `'frame'` as `frame.timestamp` and `frame.length`, the same as in `stream_attributes()`.
+    """
+    # Only have tshark serialise the layers that the attributes are taken from
+    kwargs.update(build_capture_filter_kwargs(attributes_to_add, kwargs.get('custom_parameters')))
+    live_traffic = live_capture(interface=interface, num_packets=num_packets, **kwargs)
 
-combine_dict = modify_keys_attribute_dict(combine_dict)
+    # Decode the capture once and share it between all of the OSI layers
+    packet_store = PacketStore(live_traffic)
 
-list_of_attributes_to_add = ['datalink_layer.src', 'datalink_layer.dst', 'network_layer.src', 'network_layer.dst', 'transport_layer.srcport', 'transport_layer.dstport']
-combine_dict = only_grab_specific_attributes(combine_dict, list_of_attributes_to_add)
-# pprint(testing)
-# pprint(combine_dict)
\ No newline at end of file
+    osi_layers = instantiate_all_osi_layers()
+
+    layer_info = {layer_name: get_layer_info(layer, packet_store) for layer_name, layer in osi_layers.items()}
+
+    layer_attributes = {layer_name: get_layer_attributes(layer, layer.get_packet_layer()) for layer_name, layer in layer_info.items()}
+
+    combine_dict = {}
+    for i in range(len(packet_store)):
+        packet_key_name = f'Packet {i + 1}'
+        combine_dict[packet_key_name] = {}
+        for name in layer_attributes:
+            reformat_attributes_dict(combine_dict, packet_key_name, name, layer_attributes[name])
+
+    combine_dict = modify_keys_attribute_dict(combine_dict)
+    for packet_key_name, packet_data in combine_dict.items():
+        frame_info = packet_store.frame_info[packet_key_name]
+        packet_data['frame'] = {'frame.timestamp': frame_info['timestamp'], 'frame.length': frame_info['length']}
+
+    return only_grab_specific_attributes(combine_dict, attributes_to_add)
+
+
+def capture_packet_records(interface: str = 'Ethernet 2', num_packets: int = 2, attributes_to_add: list | tuple = list_of_attributes_to_add, **kwargs) -> PacketRecords:
+    """
+    Captures live traffic straight into a `PacketRecords` store. Each packet is extracted, renamed and filtered as it is captured and only its packed attributes are kept, so neither the `PacketStore` of the whole capture nor the nested `combine_dict` is built.
+
+    Parameters:
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `num_packets` (int): specifying the number of packets to capture from the interface.
+    - `attributes_to_add` (list | tuple): The attributes to keep, in column order. Exp: `list_of_attributes_to_add`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.LiveCapture`. Exp: `encryption_type='wpa-pwk'`.
+
+    Returns:
+    - `PacketRecords`: The attributes of every packet. Exp: `store_packets(connection, packet_records, attributes_to_add)`.
+    """
+    import pyshark
+
+    kwargs.update(build_capture_filter_kwargs(attributes_to_add, kwargs.get('custom_parameters')))
+    capture = pyshark.LiveCapture(interface=interface, **kwargs)
+    packet_records = PacketRecords(attributes_to_add)
+    try:
+        for packet_key_name, packet_data in stream_attributes(capture, instantiate_all_osi_layers(), attributes_to_add, num_packets):
+            packet_records.append(packet_data)
+    finally:
+        capture.close()
+    return packet_records
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Capture live traffic and print the requested attributes of each packet.')
+    parser.add_argument('--interface', default='Ethernet 2', help='The interface to capture packets from.')
+    parser.add_argument('--num-packets', type=int, default=2, help='The number of packets to capture.')
+    parser.add_argument('--encryption-type', default='wpa-pwk', help='Passed to pyshark.LiveCapture.')
+    args = parser.parse_args()
+
+    combine_dict = capture_packets(interface=args.interface, num_packets=args.num_packets, encryption_type=args.encryption_type)
+    pprint(combine_dict)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,12 @@
-import pyshark
+from __future__ import annotations
+from functools import lru_cache
+from itertools import takewhile
+from typing import TYPE_CHECKING
+from pipeline_metrics import timed, increment
+from packet_classes import PacketStore, OSI_LAYER_NAMES, PhysicalLayer, DataLinkLayer, NetworkLayer, TransportLayer, SessionLayer, PresentationLayer, ApplicationLayer
+
+if TYPE_CHECKING:
+    import pyshark
 
 
 def live_capture(interface: str, num_packets: int, **kwargs) -> pyshark.LiveCapture:
@@ -13,8 +21,12 @@ def live_capture(interface: str, num_packets: int, **kwargs) -> pyshark.LiveCapt
     Returns:
     - `pyshark.LiveCapture`: An object that represents the live capture interface. Stores the packets from the traffic. 
     '''
+    import pyshark
+
     capture = pyshark.LiveCapture(interface=interface, **kwargs)
-    capture.sniff(packet_count=num_packets)
+    with timed('capture.sniff_seconds'):
+        capture.sniff(packet_count=num_packets)
+    increment('capture.packets', len(capture))
     return capture
 
 
@@ -31,8 +43,12 @@ def remote_capture(remote_host: str, remote_interface: str, num_packets: int, **
     Returns:
     - `pyshark.RemoteCapture`: An object that represents the remote capture interface. Stores the packets from the traffic. 
     '''
+    import pyshark
+
     capture = pyshark.RemoteCapture(remote_host=remote_host, remote_interface=remote_interface, **kwargs)
-    capture.sniff(packet_count=num_packets)
+    with timed('capture.sniff_seconds'):
+        capture.sniff(packet_count=num_packets)
+    increment('capture.packets', len(capture))
     return capture
 
 
@@ -48,8 +64,12 @@ def file_capture(file_path: str, num_packets: int, **kwargs) -> pyshark.FileCapt
     Returns:
     - `pyshark.FileCapture`: An object that represents the file capture interface. Stores the packets from the traffic. 
     '''
+    import pyshark
+
     capture = pyshark.FileCapture(input_file=file_path, **kwargs)
-    capture.sniff(packet_count=num_packets)
+    with timed('capture.sniff_seconds'):
+        capture.sniff(packet_count=num_packets)
+    increment('capture.packets', len(capture))
     return capture
 
 
@@ -64,8 +84,12 @@ def in_memory_capture(num_packets: int, **kwargs) -> pyshark.InMemCapture:
     Returns:
     - `pyshark.InMemCapture`: An object that represents the memory capture interface. Stores the packets from the traffic. 
     '''
+    import pyshark
+
     capture = pyshark.InMemCapture(**kwargs)
-    capture.sniff(packet_count=num_packets)
+    with timed('capture.sniff_seconds'):
+        capture.sniff(packet_count=num_packets)
+    increment('capture.packets', len(capture))
     return capture
 
 
@@ -81,11 +105,47 @@ def live_ring_capture(interface: str, num_packets: int, **kwargs) -> pyshark.Liv
     Returns:
     - `pyshark.LiveRingCapture`: An object that represents the live ring capture interface. Stores the packets from the traffic. 
     '''
+    import pyshark
+
     capture = pyshark.LiveRingCapture(interface=interface, **kwargs)
-    capture.sniff(packet_count=num_packets)
+    with timed('capture.sniff_seconds'):
+        capture.sniff(packet_count=num_packets)
+    increment('capture.packets', len(capture))
     return capture
 
 
+# Attribute prefixes that are not read from a dissected layer. `frame` comes from the packet info tshark always sends, `source` and `sampling` are added by the pipeline.
+PSEUDO_LAYER_NAMES = ('frame', 'source', 'sampling')
+
+
+def build_capture_filter_kwargs(search_for_iterable: list|tuple|set, custom_parameters: dict | None = None) -> dict:
+    """
+    Compiles the attributes that will be kept into tshark options, so that tshark only serialises the protocols those attributes come from instead of every layer of every packet.
+
+    Parameters:
+    - `search_for_iterable`: The attributes that will be grabbed later on. Exp: `['datalink_layer.src', 'network_layer.dst']`.
+    - `custom_parameters` (dict | None): Other tshark parameters to merge with the compiled ones.
+
+    Returns:
+    - `dict`: Keyword arguments for the `*_capture` helpers. Exp: `live_capture('Ethernet 2', 10, **build_capture_filter_kwargs(attributes))`. Attributes of the `PSEUDO_LAYER_NAMES` (Exp: `frame.timestamp`) need no protocol and are skipped. An empty dict is returned if any other attribute does not belong to a known OSI layer, since nothing can be filtered safely.
+
+    Note:
+    - Uses the tshark `-J` protocol match filter. The `geninfo` and `frame` protocols are always kept because pyshark reads the packet info from them. Packets are not dropped, only the layers that are not needed, so the rows in `packet_info` stay the same.
+    """
+    osi_layers = []
+    for attribute in search_for_iterable:
+        osi_layer = extract_substring(attribute, '.')
+        if osi_layer in PSEUDO_LAYER_NAMES:
+            continue
+        if osi_layer not in OSI_LAYER_NAMES:
+            return {}
+        if osi_layer not in osi_layers:
+            osi_layers.append(osi_layer)
+
+    protocols = [layer_name for osi_layer in osi_layers for layer_name in OSI_LAYER_NAMES[osi_layer] if layer_name is not None]
+    return {'custom_parameters': {**(custom_parameters or {}), '-J': ' '.join(['geninfo', 'frame'] + protocols)}}
+
+
 def instantiate_osi_layers(**kwargs) -> dict:
     '''
     Instantiates a custom number of objects from different `OSI` layers.
@@ -102,18 +162,29 @@ def instantiate_osi_layers(**kwargs) -> dict:
     return kwargs
 
 
+def instantiate_all_osi_layers() -> dict:
+    """
+    Instantiates an object for every layer of the `OSI` model with the same names that are used in `capture_traffic.py`.
+
+    Returns:
+    - `dict`: The same structure as the dict returned from the `instantiate_osi_layers()`.
+    """
+    return instantiate_osi_layers(physical_layer=PhysicalLayer(), datalink_layer=DataLinkLayer(), network_layer=NetworkLayer(), transport_layer=TransportLayer(), session_layer=SessionLayer(), presentation_layer=PresentationLayer(), application_layer=ApplicationLayer())
+
+
 def get_layer_info(layer, capture_interface) -> dict:
     '''
     Retrieves the layer info for each `OSI` layer that has been instantied from the `instantiate_osi_layers()`.
 
     Parameters:
     - `layer` (packet_classes.layer): Value reference that is stored in the Dictionary from the `instantiate_osi_layers()`.
-    - `capture_interface`: This is the interface that is being used to retrieve packets from.
+    - `capture_interface`: This is the interface that is being used to retrieve packets from. Pass a `packet_classes.PacketStore` to share a single decode of the capture between every layer.
 
     Returns:
     - `dict`: Contains the layer name as the `key` and the packet_classes object that contains the layers for each packet stored as the `value`.
     '''
-    return layer.get_complete_layer_info(capture_interface)
+    with timed('layers.get_layer_info_seconds'):
+        return layer.get_complete_layer_info(capture_interface)
 
 
 def get_layer_attributes(info, layer_list) -> dict:
@@ -163,13 +234,44 @@ def extract_substring(iterable: list | dict | tuple | set, identifier: str) -> s
     Returns:
     - A sub_string from the iterable. This will allow the ability to choose when an interable should stop at a specific character.
     '''
-    new_substring = str()
-    for char in iterable:
-        if char != identifier:
-            new_substring += char
+    if type(iterable) == str:
+        return iterable.partition(identifier)[0]
+    return ''.join(takewhile(lambda char: char != identifier, iterable))
+
+
+@lru_cache(maxsize=65536)
+def rename_attribute_key(layer_name: str, inner_key: str) -> str:
+    """
+    Swaps the protocol prefix of a field name for the name of its layer. The result is cached, so each distinct field name is only rewritten once.
+
+    Parameters:
+    - `layer_name` (str): The name of the layer. Exp: `'datalink_layer'`.
+    - `inner_key` (str): The field name from pyshark. Exp: `'eth.src'`.
+
+    Returns:
+    - `str`: The new field name. Exp: `'datalink_layer.src'`.
+    """
+    prefix, separator, field_name = inner_key.partition('.')
+    return f'{layer_name}{separator}{field_name}'
+
+
+def modify_keys_packet_dict(packet_data: dict) -> dict:
+    """
+    Modifies the inner keys of a single packet from the attribute dict. Used by `modify_keys_attribute_dict()` and by the streaming pipeline.
+
+    Parameters:
+    - `packet_data` (dict): The layers of one packet. Exp: `attribute_dict['Packet 1']`.
+
+    Returns:
+    - A new packet dict where the key names are more precise. Exp: `eth.src` becomes `datalink_layer.src`. The dict that was passed in and the pyshark layer fields are left unchanged.
+    """
+    new_packet_data = {}
+    for key, value in packet_data.items():
+        if value != None:
+            new_packet_data[key] = {rename_attribute_key(key, inner_key): inner_value for inner_key, inner_value in value.items()}
         else:
-            break
-    return new_substring
+            new_packet_data[key] = value
+    return new_packet_data
 
 
 def modify_keys_attribute_dict(attribute_dict: dict) -> dict:
@@ -182,15 +284,27 @@ def modify_keys_attribute_dict(attribute_dict: dict) -> dict:
     Returns:
     - A new dict where the key names are more precise.
     """
-    for index in range(len(attribute_dict)):
-        packet_num = f'Packet {index + 1}'
-        for key, value in attribute_dict[packet_num].items():
-            if value != None:
-                for inner_key in list(attribute_dict[packet_num][key]):
-                    extracted_val = extract_substring(inner_key, '.')
-                    new_dict_name = inner_key.replace(extracted_val, f'{key}')
-                    attribute_dict[packet_num][key][new_dict_name] = attribute_dict[packet_num][key].pop(inner_key)
-    return attribute_dict
+    return {packet_key_name: modify_keys_packet_dict(packet_data) for packet_key_name, packet_data in attribute_dict.items()}
+
+
+def grab_packet_attributes(packet_data: dict, search_for_iterable: list|tuple|set) -> dict:
+    """
+    Chooses specific attributes from a single packet of the attribute dict. Used by `only_grab_specific_attributes()` and by the streaming pipeline.
+
+    Parameters:
+    - `packet_data` (dict): The layers of one packet. Exp: `attribute_dict['Packet 1']`.
+    - `search_for_iterable`: An interable that contains the attribute values from the dict to only grab from.
+
+    Returns:
+    - A dict that contains the subset of layers and values for the packet.
+    """
+    subset_packet = dict()
+    for layer_name, layer_value in packet_data.items():
+        if layer_value is not None:
+            filtered_values = {key: value for key, value in layer_value.items() if key in search_for_iterable}
+            if filtered_values:
+                subset_packet[layer_name] = filtered_values
+    return subset_packet
 
 
 def only_grab_specific_attributes(attribute_dict: dict, search_for_iterable: list|tuple|set) -> dict:
@@ -207,10 +321,63 @@ def only_grab_specific_attributes(attribute_dict: dict, search_for_iterable: lis
     subset_dict = dict()
     for index, (packet_data) in enumerate(attribute_dict.values(), start=1):
         new_packet_num = f'Packet {index}'
-        subset_dict[new_packet_num] = {}
-        for layer_name, layer_value in packet_data.items():
-            if layer_value is not None:
-                filtered_values = {key: value for key, value in layer_value.items() if key in search_for_iterable}
-                if filtered_values:
-                    subset_dict[new_packet_num][layer_name] = filtered_values
+        subset_dict[new_packet_num] = grab_packet_attributes(packet_data, search_for_iterable)
     return subset_dict
+
+
+def stream_packets(capture_interface, num_packets: int | None = None):
+    """
+    Pulls packets from a capture interface one at a time instead of keeping the whole capture in memory.
+
+    Parameters:
+    - `capture_interface`: A pyshark capture object that has not been sniffed yet. Exp: `pyshark.LiveCapture(interface='Ethernet 2')`. For a `pyshark.FileCapture` pass `keep_packets=False` so that read packets are not kept.
+    - `num_packets` (int | None): The number of packets to stream. `None` streams until the capture ends or is stopped.
+
+    Returns:
+    - A generator that yields each pyshark packet as it is captured.
+    """
+    yield from capture_interface.sniff_continuously(packet_count=num_packets)
+
+
+def extract_packet_attributes(packet, osi_layers: dict) -> dict:
+    """
+    Runs the layer extraction from `packet_classes` on a single packet.
+
+    Parameters:
+    - `packet`: A single pyshark packet.
+    - `osi_layers` (dict): The dict returned from the `instantiate_osi_layers()`.
+
+    Returns:
+    - `dict`: The layers of the packet with the same structure as `combine_dict['Packet 1']`. If a packet has more than one layer for an OSI layer, the first one is used. The capture timestamp and frame length are added under `'frame'` as `frame.timestamp` and `frame.length`.
+    """
+    packet_store = PacketStore([packet])
+    packet_data = {}
+    for layer_name, layer in osi_layers.items():
+        info = get_layer_info(layer, packet_store)
+        attributes = get_layer_attributes(info, info.get_packet_layer())
+        packet_data[layer_name] = attributes.get('Packet 1')
+    packet_data['frame'] = {'frame.timestamp': getattr(packet, 'sniff_timestamp', None), 'frame.length': getattr(packet, 'length', None)}
+    return packet_data
+
+
+def stream_attributes(capture_interface, osi_layers: dict, search_for_iterable: list|tuple|set, num_packets: int | None = None):
+    """
+    Streaming version of the capture pipeline. Each packet is extracted, has its keys renamed and its attributes filtered as soon as it is captured, so memory stays flat no matter how many packets are captured.
+
+    Parameters:
+    - `capture_interface`: A pyshark capture object that has not been sniffed yet.
+    - `osi_layers` (dict): The dict returned from the `instantiate_osi_layers()`.
+    - `search_for_iterable`: An interable that contains the attribute values to only grab from. Exp: `['network_layer.src', 'network_layer.dst']`.
+    - `num_packets` (int | None): The number of packets to stream. `None` streams until the capture ends or is stopped.
+
+    Returns:
+    - A generator that yields `('Packet N', packet_data)` tuples where `packet_data` has the same structure as the values from `only_grab_specific_attributes()`. `N` is the frame number from tshark, so it stays correct when a display filter skips packets.
+    """
+    for index, packet in enumerate(stream_packets(capture_interface, num_packets), start=1):
+        packet_num = getattr(packet, 'number', None) or index
+        with timed('stream.packet_seconds'):
+            packet_data = extract_packet_attributes(packet, osi_layers)
+            packet_data = modify_keys_packet_dict(packet_data)
+            packet_data = grab_packet_attributes(packet_data, search_for_iterable)
+        increment('stream.packets')
+        yield f'Packet {packet_num}', packet_data
@@ -0,0 +1,290 @@
+import math
+import os
+import sqlite3
+import time
+from capture_traffic import list_of_attributes_to_add
+from packet_queries import TIMESTAMP_COLUMN
+from sqlite_connection import attributes, map_attributes_order, packet_to_row
+
+
+# Columns of the exported files. The capture timestamp is used to partition them.
+export_attributes = {**attributes, TIMESTAMP_COLUMN: 'REAL'}
+
+# Attributes in the same order as `export_attributes`
+export_attributes_to_add = list_of_attributes_to_add + ['frame.timestamp']
+
+# TEXT columns that repeat a small set of values, so they are stored as dictionary indices instead of one string per row
+DICTIONARY_COLUMNS = ('src_mac', 'dest_mac', 'src_ip', 'dest_ip', 'interface')
+
+FILE_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def arrow_type(sql_type: str, dictionary_encoded: bool = False):
+    """
+    Maps an SQL column type of the `packet_info` table to an Arrow type.
+    """
+    import pyarrow
+
+    if dictionary_encoded:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return {'TEXT': pyarrow.string(),
+            'INT': pyarrow.int32(),
+            'INTEGER': pyarrow.int64(),
+            'REAL': pyarrow.float64(),
+            'BLOB': pyarrow.binary()
+            }.get(sql_type.upper(), pyarrow.string())
+
+
+def convert_value(value, sql_type: str):
+    """
+    Converts a value from pyshark, which is usually a string, into the Python type of its column. Values that can not be converted become `None`, since a column of an Arrow file only holds one type.
+    """
+    if value is None:
+        return None
+    try:
+        sql_type = sql_type.upper()
+        if sql_type in ('INT', 'INTEGER'):
+            return int(value, 0) if type(value) == str else int(value)
+        if sql_type == 'REAL':
+            return float(value)
+        if sql_type == 'BLOB':
+            return bytes(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PartitionBuffer:
+    """
+    The rows of one time partition that have not been written yet, buffered per column, and the open file they go to. `dictionaries` holds the growing dictionaries of an Arrow IPC file.
+    """
+    def __init__(self, file_path: str, num_of_columns: int) -> None:
+        self.file_path = file_path
+        self.columns = [[] for _ in range(num_of_columns)]
+        self.dictionaries = {}
+        self.writer = None
+        self.num_of_rows = 0
+
+
+class ColumnarExporter:
+    """
+    Writes rows as Parquet or Arrow IPC files instead of SQLite rows, so they can be scanned column by column. The files are partitioned by capture time into Hive style directories (Exp: `capture_window=20240101T120000/part-0.parquet`). Every batch of rows becomes one row group (Parquet) or record batch (Arrow), so memory stays bounded by `batch_size` rows per open partition. Address columns are dictionary encoded.
+
+    Parameters:
+    - `base_path` (str): The directory of the partitions. It is created if it is missing.
+    - `columns` (dict): The column names as the `key` and their SQL types as the `value`. Exp: `export_attributes`.
+    - `file_format` (str): `'parquet'` or `'arrow'`.
+    - `batch_size` (int): The number of rows of a partition that are buffered before they are written.
+    - `partition_seconds` (float): The length of the time window of a partition. Rows without a `capture_timestamp` go into the window of the time they are exported.
+    - `max_open_partitions` (int): The number of partition files that are kept open. The oldest one is closed when a row for a new partition arrives.
+    - `compression` (str | None): The Parquet compression codec. Exp: `'zstd'`.
+
+    Example:
+    - `with ColumnarExporter('exports/') as exporter: exporter.add_row(row)`
+    """
+    def __init__(self, base_path: str, columns: dict = export_attributes, file_format: str = 'parquet', batch_size: int = 65536, partition_seconds: float = 3600.0, max_open_partitions: int = 4, compression: str | None = 'zstd') -> None:
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError(f'Unknown file format {file_format}, expected one of {tuple(FILE_EXTENSIONS)}')
+        import pyarrow
+
+        os.makedirs(base_path, exist_ok=True)
+        self.base_path = base_path
+        self.columns = columns
+        self.column_types = list(columns.values())
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.partition_seconds = partition_seconds
+        self.max_open_partitions = max_open_partitions
+        self.compression = compression
+        self.dictionary_columns = {index for index, (column, sql_type) in enumerate(columns.items()) if column in DICTIONARY_COLUMNS and sql_type.upper() == 'TEXT'}
+        self.timestamp_index = list(columns).index(TIMESTAMP_COLUMN) if TIMESTAMP_COLUMN in columns else None
+        self.schema = pyarrow.schema([pyarrow.field(column, arrow_type(sql_type, index in self.dictionary_columns)) for index, (column, sql_type) in enumerate(columns.items())])
+        self.partitions = {}
+        self.rows_written = 0
+
+
+    def __enter__(self) -> 'ColumnarExporter':
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def partition_for(self, timestamp: float | None) -> PartitionBuffer:
+        timestamp = time.time() if timestamp is None else timestamp
+        window_start = math.floor(timestamp / self.partition_seconds) * self.partition_seconds
+        partition = self.partitions.get(window_start)
+        if partition is None:
+            if len(self.partitions) >= self.max_open_partitions:
+                self.close_partition(min(self.partitions))
+            directory = os.path.join(self.base_path, f'capture_window={time.strftime("%Y%m%dT%H%M%S", time.gmtime(window_start))}')
+            os.makedirs(directory, exist_ok=True)
+            part_number = len(os.listdir(directory))
+            file_path = os.path.join(directory, f'part-{part_number}.{FILE_EXTENSIONS[self.file_format]}')
+            partition = self.partitions[window_start] = PartitionBuffer(file_path, len(self.columns))
+        return partition
+
+
+    def add_row(self, row: list | tuple) -> None:
+        """
+        Buffers a row in the partition of its capture time and writes the partition once `batch_size` rows are buffered.
+
+        Parameters:
+        - `row` (list | tuple): The values in column order. Exp: from `sqlite_connection.packet_to_row()`.
+        """
+        row = [convert_value(value, sql_type) for value, sql_type in zip(row, self.column_types)]
+        partition = self.partition_for(row[self.timestamp_index] if self.timestamp_index is not None else None)
+        for column_values, value in zip(partition.columns, row):
+            column_values.append(value)
+        partition.num_of_rows += 1
+        if partition.num_of_rows >= self.batch_size:
+            self.write_partition(partition)
+
+
+    def add_rows(self, rows) -> None:
+        for row in rows:
+            self.add_row(row)
+
+
+    def build_array(self, partition: PartitionBuffer, index: int, values: list):
+        """
+        Builds the Arrow array of one column. Parquet stores the dictionary of every row group in that row group, so dictionary columns get a dictionary of only the values of the batch. Arrow IPC files keep one dictionary per file that only ever grows, so later batches are written as dictionary deltas instead of replacing it.
+        """
+        import pyarrow
+
+        if index not in self.dictionary_columns:
+            return pyarrow.array(values, type=self.schema.field(index).type)
+        if self.file_format == 'parquet':
+            return pyarrow.array(values, type=pyarrow.string()).dictionary_encode()
+        value_indices, dictionary_values = partition.dictionaries.setdefault(index, ({}, []))
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            value_index = value_indices.get(value)
+            if value_index is None:
+                value_index = value_indices[value] = len(dictionary_values)
+                dictionary_values.append(value)
+            indices.append(value_index)
+        return pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, type=pyarrow.int32()), pyarrow.array(dictionary_values, type=pyarrow.string()))
+
+
+    def write_partition(self, partition: PartitionBuffer) -> int:
+        """
+        Writes the buffered rows of a partition as one row group or record batch.
+
+        Returns:
+        - `int`: The number of rows that were written.
+        """
+        import pyarrow
+
+        num_of_rows = partition.num_of_rows
+        if not num_of_rows:
+            return 0
+        batch = pyarrow.RecordBatch.from_arrays([self.build_array(partition, index, values) for index, values in enumerate(partition.columns)], schema=self.schema)
+        if partition.writer is None:
+            if self.file_format == 'parquet':
+                import pyarrow.parquet
+
+                partition.writer = pyarrow.parquet.ParquetWriter(partition.file_path, self.schema, compression=self.compression)
+            else:
+                partition.writer = pyarrow.ipc.new_file(partition.file_path, self.schema, options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        partition.writer.write_batch(batch)
+
+        partition.columns = [[] for _ in range(len(self.columns))]
+        partition.num_of_rows = 0
+        self.rows_written += num_of_rows
+        return num_of_rows
+
+
+    def close_partition(self, window_start: float) -> None:
+        partition = self.partitions.pop(window_start)
+        self.write_partition(partition)
+        if partition.writer is not None:
+            partition.writer.close()
+
+
+    def close(self) -> None:
+        """
+        Writes every buffered row and closes every partition file.
+        """
+        for window_start in list(self.partitions):
+            self.close_partition(window_start)
+
+
+def export_packet_stream(base_path: str, packet_stream, attributes_to_add: list | tuple = export_attributes_to_add, columns: dict = export_attributes, **kwargs) -> int:
+    """
+    Exports packets to columnar files as they are handed over from a packet stream.
+
+    Parameters:
+    - `base_path` (str): The directory of the partitions.
+    - `packet_stream`: An iterable of `('Packet N', packet_data)` tuples. Exp: `capture_traffic_functions.stream_attributes()` or the `items()` of the `only_grab_specific_attributes()` output.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as `columns`.
+    - `columns` (dict): The columns of the files.
+    - `**kwargs`: Additional keyword arguments passed to `ColumnarExporter`. Exp: `file_format='arrow'`.
+
+    Returns:
+    - `int`: The number of packets that were exported.
+    """
+    mapping_attributes_order = map_attributes_order(attributes_to_add)
+    with ColumnarExporter(base_path, columns, **kwargs) as exporter:
+        for packet_key_name, packet_data in packet_stream:
+            exporter.add_row(packet_to_row(packet_data, mapping_attributes_order, len(columns)))
+    return exporter.rows_written
+
+
+def export_combine_dict(base_path: str, combine_dict: dict, attributes_to_add: list | tuple = export_attributes_to_add, columns: dict = export_attributes, **kwargs) -> int:
+    """
+    Exports the dict returned from the `capture_traffic.capture_packets()` to columnar files. Captured with `frame.timestamp` in its `attributes_to_add` (Exp: `export_attributes_to_add`), every packet goes into the partition of its capture time.
+    """
+    return export_packet_stream(base_path, combine_dict.items(), attributes_to_add, columns, **kwargs)
+
+
+def export_sqlite_table(connection: sqlite3.Connection, base_path: str, table_name: str = 'packet_info', fetch_size: int = 10000, **kwargs) -> int:
+    """
+    Exports a table that is already in SQLite to columnar files, reading it `fetch_size` rows at a time. The column types are taken from the table.
+
+    Returns:
+    - `int`: The number of rows that were exported.
+    """
+    columns = {row[1]: row[2] or 'TEXT' for row in connection.execute(f'PRAGMA table_info({table_name})') if row[1] != 'Packet_ID'}
+    cursor = connection.execute(f'SELECT {", ".join(columns)} FROM {table_name} ORDER BY Packet_ID')
+    try:
+        with ColumnarExporter(base_path, columns, **kwargs) as exporter:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                exporter.add_rows(rows)
+    finally:
+        cursor.close()
+    return exporter.rows_written
+
+
+def scan_export(base_path: str, file_format: str = 'parquet', columns: list | None = None, start_time: float | None = None, end_time: float | None = None):
+    """
+    Reads exported files as one Arrow table, only reading the columns that are asked for. The files are memory mapped, so Arrow IPC columns are not copied.
+
+    Parameters:
+    - `base_path` (str): The directory of the partitions.
+    - `file_format` (str): `'parquet'` or `'arrow'`.
+    - `columns` (list | None): The columns to read. `None` reads every column.
+    - `start_time` (float | None): Only returns packets captured from this time on.
+    - `end_time` (float | None): Only returns packets captured before this time.
+
+    Returns:
+    - `pyarrow.Table`: Exp: `scan_export('exports/', columns=['src_ip', 'dest_port']).to_pandas()`.
+    """
+    import pyarrow.dataset
+    import pyarrow.fs
+
+    dataset = pyarrow.dataset.dataset(base_path, format='parquet' if file_format == 'parquet' else 'ipc', partitioning='hive', filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    expression = None
+    if start_time is not None:
+        expression = pyarrow.dataset.field(TIMESTAMP_COLUMN) >= start_time
+    if end_time is not None:
+        end_expression = pyarrow.dataset.field(TIMESTAMP_COLUMN) < end_time
+        expression = end_expression if expression is None else expression & end_expression
+    return dataset.to_table(columns=columns, filter=expression)
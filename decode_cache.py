@@ -0,0 +1,215 @@
+import hashlib
+from itertools import islice
+import marshal
+import os
+import sys
+import zlib
+from packet_classes import PacketStore
+from pipeline_metrics import increment, timed
+
+
+# Bumped whenever the layout of the cache files changes, so old files are never read
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_EXTENSION = '.decode'
+
+
+class CachedLayer:
+    """
+    A layer read back from the decode cache. It has the parts of a pyshark layer the `OSI*Layer` classes use, `layer_name`, `_all_fields` and `get()`.
+    """
+    __slots__ = ('layer_name', '_all_fields')
+
+    def __init__(self, layer_name: str, all_fields: dict) -> None:
+        self.layer_name = layer_name
+        self._all_fields = all_fields
+
+
+    def get(self, attribute: str, default=None):
+        return self._all_fields.get(f'{self.layer_name}.{attribute}', self._all_fields.get(attribute, default))
+
+
+class CachedPacket:
+    """
+    A packet read back from the decode cache. Iterating it yields its layers, the same as a pyshark packet.
+    """
+    __slots__ = ('number', 'sniff_timestamp', 'length', 'layers')
+
+    def __init__(self, number, sniff_timestamp, length, layers: list[CachedLayer]) -> None:
+        self.number = number
+        self.sniff_timestamp = sniff_timestamp
+        self.length = length
+        self.layers = layers
+
+
+    def __iter__(self):
+        return iter(self.layers)
+
+
+def field_value(value):
+    """
+    Turns a pyshark field into a plain value that can be stored. `LayerField`s of XML layers store their shown value, and `str` subclasses are stored as `str` since `marshal` only writes exact types.
+    """
+    if hasattr(value, 'get_default_value'):
+        value = value.get_default_value()
+    return str(value) if isinstance(value, str) else value
+
+
+def encode_packets(packets) -> bytes:
+    """
+    Packs decoded packets into the compact binary format of the cache. Layer and field names are interned so `marshal` writes each of them once, and the result is compressed with zlib.
+    """
+    records = []
+    for packet in packets:
+        layers = tuple((sys.intern(layer.layer_name), {sys.intern(name): field_value(value) for name, value in layer._all_fields.items()}) for layer in packet)
+        records.append((getattr(packet, 'number', None), getattr(packet, 'sniff_timestamp', None), getattr(packet, 'length', None), layers))
+    return zlib.compress(marshal.dumps((CACHE_FORMAT_VERSION, records)), 6)
+
+
+def decode_packets(data: bytes) -> list[CachedPacket] | None:
+    """
+    Unpacks the packets of a cache file. Returns `None` if the file was written by another version of the cache.
+    """
+    format_version, records = marshal.loads(zlib.decompress(data))
+    if format_version != CACHE_FORMAT_VERSION:
+        return None
+    return [CachedPacket(number, sniff_timestamp, length, [CachedLayer(layer_name, all_fields) for layer_name, all_fields in layers]) for number, sniff_timestamp, length, layers in records]
+
+
+def file_content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-256 of the content of a file, so a renamed or copied capture still hits the cache and a rewritten one does not.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as capture_file:
+        while chunk := capture_file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DecodeCache:
+    """
+    On-disk cache of decoded capture files, keyed on the content of the file and the tshark options it was decoded with. Every entry is one file in `cache_dir`. The least recently used entries are removed once the cache is larger than `max_bytes`.
+
+    Parameters:
+    - `cache_dir` (str): The directory of the cache files. It is created if it is missing.
+    - `max_bytes` (int): The maximum size of the cache in bytes.
+
+    Example:
+    - `packet_store = cached_file_capture('capture.pcap', cache=DecodeCache('.decode_cache'))` and then `get_layer_info(layer, packet_store)` as usual.
+    """
+    def __init__(self, cache_dir: str = '.decode_cache', max_bytes: int = 1 << 30) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+
+    def cache_key(self, file_path: str, num_packets: int | None = None, **kwargs) -> str:
+        """
+        Builds the key of a capture file. The same file decoded with other options (Exp: a `display_filter` or `decode_as`) gets another key.
+        """
+        options = repr(sorted((name, repr(value)) for name, value in kwargs.items()))
+        return hashlib.sha256(f'{file_content_hash(file_path)}|{num_packets}|{options}|{marshal.version}'.encode()).hexdigest()
+
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+
+    def get(self, key: str) -> list[CachedPacket] | None:
+        """
+        Returns the packets of an entry, or `None` on a miss. A hit marks the entry as recently used.
+        """
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                data = entry_file.read()
+        except FileNotFoundError:
+            increment('decode_cache.misses')
+            return None
+        try:
+            packets = decode_packets(data)
+        except (ValueError, EOFError, TypeError, zlib.error):
+            packets = None
+        if packets is None:
+            os.remove(entry_path)
+            increment('decode_cache.misses')
+            return None
+        os.utime(entry_path)
+        increment('decode_cache.hits')
+        return packets
+
+
+    def put(self, key: str, packets) -> list[CachedPacket]:
+        """
+        Stores the packets of an entry and evicts old entries if the cache is too large.
+
+        Returns:
+        - `list`: The packets as they are read back from the cache, so a miss and a hit return the same objects.
+        """
+        data = encode_packets(packets)
+        entry_path = self.entry_path(key)
+        temp_path = f'{entry_path}.tmp'
+        with open(temp_path, 'wb') as entry_file:
+            entry_file.write(data)
+        os.replace(temp_path, entry_path)
+        self.evict(keep=entry_path)
+        return decode_packets(data)
+
+
+    def evict(self, keep: str | None = None) -> list[str]:
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`.
+
+        Parameters:
+        - `keep` (str | None): An entry that is never removed. Exp: the entry that was just written.
+
+        Returns:
+        - `list`: The entries that were removed.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_FILE_EXTENSION):
+                entry_stat = os.stat(os.path.join(self.cache_dir, file_name))
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, os.path.join(self.cache_dir, file_name)))
+
+        cache_size = sum(size for mtime, size, entry_path in entries)
+        removed_entries = []
+        for mtime, size, entry_path in sorted(entries):
+            if cache_size <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            os.remove(entry_path)
+            cache_size -= size
+            removed_entries.append(entry_path)
+            increment('decode_cache.evictions')
+        return removed_entries
+
+
+def cached_file_capture(file_path: str, num_packets: int | None = None, cache: DecodeCache | None = None, **kwargs) -> PacketStore:
+    """
+    Cached version of `capture_traffic_functions.file_capture()`. A capture file that was already decoded with the same options is read from the cache without starting tshark.
+
+    Parameters:
+    - `file_path` (str): A file path that will be used to capture traffic from.
+    - `num_packets` (int | None): The number of packets to read. `None` reads the whole file.
+    - `cache` (DecodeCache | None): The cache to use. Defaults to `DecodeCache()`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture`. They are part of the cache key.
+
+    Returns:
+    - `PacketStore`: Pass it to `get_layer_info()` as the `capture_interface`, so every `OSI*Layer` reads from it.
+    """
+    cache = cache if cache is not None else DecodeCache()
+    key = cache.cache_key(file_path, num_packets, **kwargs)
+    packets = cache.get(key)
+    if packets is None:
+        import pyshark
+
+        capture = pyshark.FileCapture(input_file=file_path, keep_packets=False, **kwargs)
+        try:
+            with timed('decode_cache.decode_seconds'):
+                packets = cache.put(key, islice(capture, num_packets))
+        finally:
+            capture.close()
+    return PacketStore(packets)
@@ -1,9 +1,15 @@
-import pyshark
 from packet_classes import PhysicalLayer, DataLinkLayer, NetworkLayer, TransportLayer, SessionLayer, PresentationLayer, ApplicationLayer 
 from pprint import pprint
 
-capture_live_traffic = pyshark.LiveCapture(interface='Ethernet 2')
-capture_live_traffic.sniff(packet_count=10)
+
+def main() -> None:
+    import pyshark
+
+    capture_live_traffic = pyshark.LiveCapture(interface='Ethernet 2')
+    capture_live_traffic.sniff(packet_count=10)
+    for packet in capture_live_traffic:
+        print(packet)
+
 
 # Below are a few examples on how to access specific information from different layers within packets
 '''
@@ -24,3 +30,7 @@ for packet in capture_live_traffic:
             # print(layer.field_names)
             print(f'Src Mac: {packet.eth.src}, Dest Mac: {packet.eth.dst}')
 '''
+
+
+if __name__ == '__main__':
+    main()
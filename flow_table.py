@@ -0,0 +1,202 @@
+from collections import OrderedDict
+import sqlite3
+from capture_traffic_functions import stream_packets
+from packet_classes import classify_layer
+from sqlite_connection import PacketInfoWriter, create_table_for_db, format_attribute_columns_for_table
+
+
+# Columns of the flows table
+flow_attributes = {'src_ip': 'TEXT',
+                   'dest_ip': 'TEXT',
+                   'src_port': 'INT',
+                   'dest_port': 'INT',
+                   'proto': 'TEXT',
+                   'packets': 'INT',
+                   'bytes': 'INT',
+                   'first_seen': 'REAL',
+                   'last_seen': 'REAL',
+                   'tcp_flags': 'INT',
+                   'end_reason': 'TEXT'
+                   }
+
+TCP_FIN = 0x01
+TCP_RST = 0x04
+
+
+class Flow:
+    """
+    Packet and byte counts, first/last timestamps and the OR of the TCP flags of one direction of a connection.
+    """
+    __slots__ = ('key', 'packets', 'bytes', 'first_seen', 'last_seen', 'tcp_flags', 'end_reason')
+
+    def __init__(self, key: tuple, timestamp: float) -> None:
+        self.key = key
+        self.packets = 0
+        self.bytes = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.tcp_flags = 0
+        self.end_reason = None
+
+
+    def as_row(self) -> tuple:
+        """
+        Returns the flow in the column order of `flow_attributes`.
+        """
+        return (*self.key, self.packets, self.bytes, self.first_seen, self.last_seen, self.tcp_flags, self.end_reason)
+
+
+class FlowTable:
+    """
+    In-stream flow table keyed on the 5-tuple `(src_ip, dest_ip, src_port, dest_port, proto)`. Flows are kept in least recently used order, so the flows that have been idle the longest are always at the front.
+
+    Parameters:
+    - `idle_timeout` (float): Seconds without a packet after which a flow is finished.
+    - `active_timeout` (float): Seconds after which a long running flow is finished and a new one is started, so long connections still show up regularly.
+    - `max_flows` (int): The number of flows kept in memory. The least recently used flow is finished when there are more.
+
+    Example:
+    - `finished_flows = flow_table.update(key, timestamp, length, tcp_flags)` and then `flow_table.flush()` at the end of the capture.
+    """
+    def __init__(self, idle_timeout: float = 60.0, active_timeout: float = 1800.0, max_flows: int = 100000) -> None:
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()
+
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+
+    def finish(self, key: tuple, end_reason: str) -> Flow:
+        flow = self.flows.pop(key)
+        flow.end_reason = end_reason
+        return flow
+
+
+    def expire(self, now: float) -> list[Flow]:
+        """
+        Finishes every flow that has been idle for longer than the idle timeout.
+        """
+        finished_flows = []
+        while self.flows:
+            key, flow = next(iter(self.flows.items()))
+            if now - flow.last_seen < self.idle_timeout:
+                break
+            finished_flows.append(self.finish(key, 'idle'))
+        return finished_flows
+
+
+    def update(self, key: tuple, timestamp: float, length: int, tcp_flags: int = 0) -> list[Flow]:
+        """
+        Adds a packet to its flow.
+
+        Parameters:
+        - `key` (tuple): The 5-tuple of the packet. Exp: `('10.0.0.1', '10.0.0.2', 51000, 443, 'tcp')`.
+        - `timestamp` (float): The capture timestamp of the packet.
+        - `length` (int): The frame length of the packet in bytes.
+        - `tcp_flags` (int): The TCP flags of the packet, `0` for other protocols.
+
+        Returns:
+        - `list`: The flows that were finished by this packet, because of a timeout, a TCP FIN/RST or the table being full.
+        """
+        finished_flows = self.expire(timestamp)
+
+        flow = self.flows.get(key)
+        if flow is not None and timestamp - flow.first_seen >= self.active_timeout:
+            finished_flows.append(self.finish(key, 'active'))
+            flow = None
+        if flow is None:
+            flow = self.flows[key] = Flow(key, timestamp)
+        else:
+            self.flows.move_to_end(key)
+
+        flow.packets += 1
+        flow.bytes += length
+        flow.last_seen = max(flow.last_seen, timestamp)
+        flow.tcp_flags |= tcp_flags
+
+        if tcp_flags & (TCP_FIN | TCP_RST):
+            finished_flows.append(self.finish(key, 'tcp_close'))
+        elif len(self.flows) > self.max_flows:
+            finished_flows.append(self.finish(next(iter(self.flows)), 'evicted'))
+        return finished_flows
+
+
+    def flush(self) -> list[Flow]:
+        """
+        Finishes every flow that is still in the table. Used at the end of a capture.
+        """
+        return [self.finish(key, 'end_of_capture') for key in list(self.flows)]
+
+
+def parse_int(value, default: int = 0) -> int:
+    """
+    Parses a pyshark field that may be decimal or hex. Exp: `'443'` or `'0x0012'`.
+    """
+    try:
+        return int(value, 0) if type(value) == str else int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def extract_flow_fields(packet) -> tuple | None:
+    """
+    Takes the fields of a flow from the first network and transport layer of a pyshark packet.
+
+    Returns:
+    - `tuple`: `(key, timestamp, length, tcp_flags)` for `FlowTable.update()`, or `None` if the packet has no network or transport layer (Exp: ARP).
+    """
+    network_layer = transport_layer = None
+    for layer in packet:
+        osi_layer = classify_layer(layer.layer_name)
+        if osi_layer == 'network_layer' and network_layer is None:
+            network_layer = layer
+        elif osi_layer == 'transport_layer' and transport_layer is None:
+            transport_layer = layer
+    if network_layer is None or transport_layer is None:
+        return None
+
+    key = (network_layer.get('src', None),
+           network_layer.get('dst', None),
+           parse_int(transport_layer.get('srcport', None)),
+           parse_int(transport_layer.get('dstport', None)),
+           transport_layer.layer_name
+           )
+    tcp_flags = parse_int(transport_layer.get('flags', None)) if transport_layer.layer_name == 'tcp' else 0
+    timestamp = float(getattr(packet, 'sniff_timestamp', 0) or 0)
+    return key, timestamp, parse_int(getattr(packet, 'length', 0)), tcp_flags
+
+
+def create_flows_table(connection: sqlite3.Connection) -> sqlite3.Cursor:
+    """
+    Creates the `flows` table if it is not already present.
+    """
+    return create_table_for_db(connection, f"""CREATE TABLE IF NOT EXISTS flows (Flow_ID INTEGER PRIMARY KEY, {format_attribute_columns_for_table(flow_attributes)})""")
+
+
+def aggregate_flows(connection: sqlite3.Connection, capture_interface, num_packets: int | None = None, flow_table: FlowTable | None = None, **kwargs) -> FlowTable:
+    """
+    Streams packets from a capture into a flow table and stores every finished flow in the `flows` table, instead of one row per packet.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `capture_interface`: A pyshark capture object that has not been sniffed yet.
+    - `num_packets` (int | None): The number of packets to stream. `None` streams until the capture ends or is stopped.
+    - `flow_table` (FlowTable | None): The flow table to use. Defaults to a `FlowTable()` with the default timeouts.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`. Exp: `batch_size=500`.
+
+    Returns:
+    - `FlowTable`: The flow table, which is empty once the capture has ended.
+    """
+    flow_table = flow_table if flow_table is not None else FlowTable()
+    create_flows_table(connection)
+    with PacketInfoWriter(connection, flow_attributes, table_name='flows', **kwargs) as writer:
+        for packet in stream_packets(capture_interface, num_packets):
+            flow_fields = extract_flow_fields(packet)
+            if flow_fields is None:
+                continue
+            writer.add_rows(flow.as_row() for flow in flow_table.update(*flow_fields))
+        writer.add_rows(flow.as_row() for flow in flow_table.flush())
+    return flow_table
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+from bulk_ingestion import find_capture_files
+from capture_traffic_functions import instantiate_all_osi_layers, stream_attributes
+from packet_queries import get_column_types
+from sqlite_connection import PacketInfoWriter, attributes, convert_typed_row, create_packet_info_table, create_table_for_db, map_attributes_order, packet_to_row, typed_attributes
+
+
+def create_checkpoint_table(connection: sqlite3.Connection) -> sqlite3.Cursor:
+    """
+    Creates the `ingest_checkpoints` table if it is not already present. It stores how far each capture file has been ingested into `packet_info`.
+    """
+    return create_table_for_db(connection, """CREATE TABLE IF NOT EXISTS ingest_checkpoints (file_path TEXT PRIMARY KEY, file_size INTEGER, file_mtime REAL, last_frame INTEGER, completed INTEGER)""")
+
+
+def get_checkpoint(connection: sqlite3.Connection, file_path: str) -> dict | None:
+    """
+    Returns the checkpoint of a capture file, or `None` if it has never been ingested.
+
+    Returns:
+    - `dict`: Exp: `{'file_size': 1048576, 'file_mtime': 1700000000.0, 'last_frame': 5120, 'completed': False}`.
+    """
+    row = connection.execute('SELECT file_size, file_mtime, last_frame, completed FROM ingest_checkpoints WHERE file_path = ?', (os.path.abspath(file_path),)).fetchone()
+    if row is None:
+        return None
+    return {'file_size': row[0], 'file_mtime': row[1], 'last_frame': row[2], 'completed': bool(row[3])}
+
+
+def save_checkpoint(connection: sqlite3.Connection, file_path: str, file_size: int, file_mtime: float, last_frame: int, completed: bool) -> None:
+    """
+    Stores the checkpoint of a capture file. It does not commit, so it can be part of the same transaction as the rows it describes.
+    """
+    connection.execute('INSERT OR REPLACE INTO ingest_checkpoints (file_path, file_size, file_mtime, last_frame, completed) VALUES (?,?,?,?,?)', (os.path.abspath(file_path), file_size, file_mtime, last_frame, int(completed)))
+
+
+def ingest_file_incrementally(connection: sqlite3.Connection, file_path: str, attributes_to_add: list | tuple, columns: dict = attributes, writer_kwargs: dict | None = None, **kwargs) -> dict:
+    """
+    Ingests a capture file into `packet_info`, carrying on from its last checkpoint.
+
+    - A file that was fully ingested and has not changed (same size and mtime) is skipped.
+    - A file that was partly ingested, or has grown since (Exp: a capture that was still being written), resumes after the last committed frame. tshark skips the earlier frames with a `frame.number` display filter.
+    - A file that got smaller has been rewritten and is ingested again from the start.
+
+    The rows and the checkpoint are committed in the same transaction, so after a crash the checkpoint always matches the rows in the database.
+
+    Columns the table stores with the typed schema (Exp: `src_ip BLOB`, `src_mac INTEGER`) get their values converted with `sqlite_connection.convert_typed_row()`, so the indexed lookups of `packet_queries` find them, whichever `columns` were passed.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `file_path` (str): The capture file to ingest.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns.
+    - `columns` (dict): The columns of the `packet_info` table.
+    - `writer_kwargs` (dict | None): Additional keyword arguments passed to `PacketInfoWriter`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture`.
+
+    Returns:
+    - `dict`: Exp: `{'file': 'a.pcap', 'status': 'resumed', 'start_frame': 5120, 'packets': 880}`. The status is one of `'skipped'`, `'ingested'` or `'resumed'`.
+    """
+    import pyshark
+
+    file_stat = os.stat(file_path)
+    checkpoint = get_checkpoint(connection, file_path)
+    if checkpoint is not None and checkpoint['completed'] and checkpoint['file_size'] == file_stat.st_size and checkpoint['file_mtime'] == file_stat.st_mtime:
+        return {'file': file_path, 'status': 'skipped', 'start_frame': checkpoint['last_frame'], 'packets': 0}
+
+    start_frame = 0
+    if checkpoint is not None and file_stat.st_size >= checkpoint['file_size']:
+        start_frame = checkpoint['last_frame']
+    if start_frame:
+        display_filter = kwargs.pop('display_filter', None)
+        kwargs['display_filter'] = f'({display_filter}) and frame.number > {start_frame}' if display_filter else f'frame.number > {start_frame}'
+
+    last_frame = start_frame
+    completed = False
+
+    def update_checkpoint(connection: sqlite3.Connection) -> None:
+        save_checkpoint(connection, file_path, file_stat.st_size, file_stat.st_mtime, last_frame, completed)
+
+    mapping_attributes_order = map_attributes_order(attributes_to_add)
+    if 'network_layer.proto' in mapping_attributes_order:
+        # IPv6 stores the protocol number in `nxt` instead of `proto`
+        mapping_attributes_order.setdefault('network_layer.nxt', mapping_attributes_order['network_layer.proto'])
+    column_types = get_column_types(connection)
+    typed_columns = [column if column_types.get(column) == typed_attributes.get(column) else None for column in columns]
+    if not any(typed_columns):
+        typed_columns = None
+    capture = pyshark.FileCapture(input_file=file_path, keep_packets=False, **kwargs)
+    try:
+        with PacketInfoWriter(connection, columns, on_flush=update_checkpoint, **(writer_kwargs or {})) as writer:
+            for packet_key_name, packet_data in stream_attributes(capture, instantiate_all_osi_layers(), attributes_to_add):
+                # The idle flush thread must not commit the checkpoint of a frame whose row is not buffered yet
+                with writer.lock:
+                    last_frame = int(packet_key_name.split(' ')[1])
+                    row = packet_to_row(packet_data, mapping_attributes_order, len(columns))
+                    writer.add_row(convert_typed_row(row, typed_columns) if typed_columns is not None else row)
+            completed = True
+    finally:
+        capture.close()
+
+    with connection:
+        update_checkpoint(connection)
+    return {'file': file_path, 'status': 'resumed' if start_frame else 'ingested', 'start_frame': start_frame, 'packets': writer.rows_written}
+
+
+def ingest_incrementally(connection: sqlite3.Connection, path: str, attributes_to_add: list | tuple, columns: dict = attributes, writer_kwargs: dict | None = None, **kwargs) -> list[dict]:
+    """
+    Ingests every capture file in a directory or glob, skipping the files that were already fully ingested.
+
+    Parameters:
+    - `path` (str): A directory, a glob pattern or a single file. Exp: `'captures/'`.
+    - The other parameters are the same as `ingest_file_incrementally()`.
+
+    Returns:
+    - `list`: The dict returned from the `ingest_file_incrementally()` for each file, in sorted file order.
+    """
+    create_packet_info_table(connection, columns)
+    create_checkpoint_table(connection)
+    return [ingest_file_incrementally(connection, file_path, attributes_to_add, columns, writer_kwargs, **kwargs) for file_path in find_capture_files(path)]
@@ -0,0 +1,201 @@
+import argparse
+import multiprocessing
+import queue
+import signal
+import sqlite3
+import threading
+import time
+from capture_traffic import list_of_attributes_to_add
+from capture_traffic_functions import build_capture_filter_kwargs, instantiate_all_osi_layers, stream_attributes
+from pipeline_metrics import increment, set_gauge
+from sqlite_connection import PacketInfoWriter, attributes, create_connection_to_db, create_packet_info_table, map_attributes_order, packet_to_row
+
+
+# Columns of packet_info when packets from several sources share one table
+source_attributes = {**attributes, 'interface': 'TEXT'}
+
+# The attribute every record is tagged with, in the column order of `source_attributes`
+SOURCE_ATTRIBUTE = 'source.interface'
+
+
+class CaptureSource:
+    """
+    One interface to capture from, with its throughput stats. Every source gets its own pyshark capture, and so its own tshark subprocess, in its own worker process, so the XML decoding of several NICs runs in parallel instead of sharing one GIL.
+
+    Parameters:
+    - `interface` (str): The interface to capture packets from. Exp: `'eth0'`. For a remote source this is the remote interface.
+    - `remote_host` (str | None): Captures from an rpcapd host with `pyshark.RemoteCapture` instead of `pyshark.LiveCapture`.
+    - `num_packets` (int | None): The number of packets to capture. `None` captures until the orchestrator is stopped.
+    - `name` (str | None): The value records are tagged with. Defaults to the interface, or `'<remote_host>:<interface>'` for a remote source.
+    - `**kwargs`: Additional keyword arguments passed to the pyshark capture. Exp: `bpf_filter='tcp'`.
+    """
+    def __init__(self, interface: str, remote_host: str | None = None, num_packets: int | None = None, name: str | None = None, **kwargs) -> None:
+        self.interface = interface
+        self.remote_host = remote_host
+        self.num_packets = num_packets
+        self.name = name or (f'{remote_host}:{interface}' if remote_host else interface)
+        self.capture_kwargs = kwargs
+        self.packets = 0
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+
+    def create_capture(self):
+        import pyshark
+
+        if self.remote_host is not None:
+            return pyshark.RemoteCapture(remote_host=self.remote_host, remote_interface=self.interface, **self.capture_kwargs)
+        return pyshark.LiveCapture(interface=self.interface, **self.capture_kwargs)
+
+
+    def packets_per_second(self) -> float:
+        if self.start_time is None:
+            return 0.0
+        elapsed = (self.end_time or time.monotonic()) - self.start_time
+        return self.packets / elapsed if elapsed > 0 else 0.0
+
+
+    def as_dict(self) -> dict:
+        return {'name': self.name, 'packets': self.packets, 'packets_per_second': self.packets_per_second(), 'error': self.error}
+
+
+class SourceStopped(Exception):
+    """
+    Raised inside a worker when it is told to stop while it waits for packets, so its capture is closed on the way out.
+    """
+
+
+def stop_source(signal_number, frame) -> None:
+    raise SourceStopped()
+
+
+def run_capture_source(source_index: int, source: CaptureSource, records, attributes_to_add: list | tuple, mapping_attributes_order: dict, num_cols: int, stop_event) -> None:
+    """
+    Worker process of one source. Streams its packets, tags each record with the source name and hands the row to the writer through `records` as `(source_index, row, None)`. It always ends with `(source_index, None, error)`, where `error` is `None` or the error of the source, so one failing source does not stop the others.
+
+    `SIGTERM` stops a worker that is waiting on a quiet interface. Its capture, and so its tshark subprocess, is closed before it exits.
+    """
+    signal.signal(signal.SIGTERM, stop_source)
+    error = None
+    capture = None
+    try:
+        capture = source.create_capture()
+        for packet_key_name, packet_data in stream_attributes(capture, instantiate_all_osi_layers(), attributes_to_add, source.num_packets):
+            packet_data['source'] = {SOURCE_ATTRIBUTE: source.name}
+            row = packet_to_row(packet_data, mapping_attributes_order, num_cols)
+            # Never block for good on a full queue, the writer may already be gone
+            while not stop_event.is_set():
+                try:
+                    records.put((source_index, row, None), timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+            if stop_event.is_set():
+                break
+    except SourceStopped:
+        pass
+    except Exception as error_raised:
+        error = repr(error_raised)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if capture is not None:
+            try:
+                capture.close()
+            except Exception:
+                pass
+    records.put((source_index, None, error))
+
+
+def capture_from_sources(connection: sqlite3.Connection, sources: list[CaptureSource], attributes_to_add: list | tuple = list_of_attributes_to_add, columns: dict = source_attributes, queue_size: int = 10000, duration: float | None = None, stop_event: threading.Event | None = None, stop_timeout: float = 5.0, **kwargs) -> list[dict]:
+    """
+    Captures from several interfaces at once and stores every packet in one `packet_info` table, tagged with the interface it came from. Every source runs in its own worker process that only captures and extracts, a single writer on the calling thread does every insert.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `sources` (list): The `CaptureSource`s to capture from.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns, without the interface.
+    - `columns` (dict): The columns of the `packet_info` table. The last one stores the source name. It is added to an existing table that does not have it.
+    - `queue_size` (int): The number of records that can wait for the writer. A worker waits when the queue is full.
+    - `duration` (float | None): Seconds to capture for. `None` captures until every source is done or `stop_event` is set.
+    - `stop_event` (Event | None): Set it from another thread to stop every source.
+    - `stop_timeout` (float): Seconds a worker gets to finish once the capture is stopped. A worker that is still waiting for packets after that (Exp: on a quiet interface) is sent `SIGTERM`, which closes its capture.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`.
+
+    Returns:
+    - `list`: The stats of each source. Exp: `[{'name': 'eth0', 'packets': 5120, 'packets_per_second': 853.3, 'error': None}, ...]`. A source that failed has its error set while the others carry on.
+    """
+    create_packet_info_table(connection, columns)
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    worker_stop_event = multiprocessing.Event()
+    records = multiprocessing.Queue(maxsize=queue_size)
+    search_for_iterable = list(attributes_to_add)
+    mapping_attributes_order = map_attributes_order(search_for_iterable + [SOURCE_ATTRIBUTE])
+
+    workers = [multiprocessing.Process(target=run_capture_source, args=(source_index, source, records, search_for_iterable, mapping_attributes_order, len(columns), worker_stop_event), name=f'capture-{source.name}', daemon=True) for source_index, source in enumerate(sources)]
+    start_time = time.monotonic()
+    for source, worker in zip(sources, workers):
+        source.start_time = start_time
+        worker.start()
+
+    finished = set()
+    stop_time = None
+    with PacketInfoWriter(connection, columns, **kwargs) as writer:
+        while len(finished) < len(workers):
+            if duration is not None and time.monotonic() - start_time >= duration:
+                stop_event.set()
+            if stop_event.is_set() and stop_time is None:
+                stop_time = time.monotonic()
+                worker_stop_event.set()
+            if stop_time is not None and time.monotonic() - stop_time >= stop_timeout:
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
+                stop_time = float('inf')
+
+            try:
+                source_index, row, error = records.get(timeout=0.1)
+            except queue.Empty:
+                writer.flush_if_due()
+                # A worker that died without reporting (Exp: killed) is finished as well
+                finished.update(source_index for source_index, worker in enumerate(workers) if worker.exitcode is not None and not worker.is_alive() and records.empty())
+                continue
+
+            source = sources[source_index]
+            if row is None:
+                finished.add(source_index)
+                source.end_time = time.monotonic()
+                if error is not None:
+                    source.error = error
+                    increment('multi_capture.failed_sources')
+                continue
+            writer.add_row(row)
+            source.packets += 1
+            increment(f'multi_capture.{source.name}.packets')
+            set_gauge('multi_capture.queue_depth', records.qsize())
+
+    for source, worker in zip(sources, workers):
+        worker.join()
+        if source.end_time is None:
+            source.end_time = time.monotonic()
+    return [source.as_dict() for source in sources]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Capture from several interfaces at once into one packet_info table.')
+    parser.add_argument('interfaces', nargs='+', help='The interfaces to capture packets from. Exp: eth0 eth1.')
+    parser.add_argument('--num-packets', type=int, help='The number of packets to capture from each interface.')
+    parser.add_argument('--duration', type=float, help='Seconds to capture for.')
+    parser.add_argument('--db', default='packet_storage.db', help='The database file to store the packets in.')
+    args = parser.parse_args()
+
+    capture_kwargs = build_capture_filter_kwargs(list_of_attributes_to_add)
+    sources = [CaptureSource(interface, num_packets=args.num_packets, **capture_kwargs) for interface in args.interfaces]
+    connection = create_connection_to_db(args.db)
+    for source_stats in capture_from_sources(connection, sources, duration=args.duration):
+        print(source_stats)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,52 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Optional, Union
-import pyshark
+from typing import TYPE_CHECKING, Optional, Union
+from pipeline_metrics import timed, increment
+
+if TYPE_CHECKING:
+    import pyshark
+
+
+# Layer names that belong to each OSI layer. Use `register_layer_name()` to add new ones so that the dispatch table below stays in sync.
+OSI_LAYER_NAMES = {
+    'physical_layer': [None],
+    'datalink_layer': ['eth', 'arp', 'rarp', 'cslip', 'ppp', 'ppp-mp', 'slip'],
+    'network_layer': ['ip', 'ipv6', 'icmp', 'icmpv6', 'igmp', 'bgp', 'egp', 'ggp', 'igrp', 'nd', 'ospf', 'rip', 'ripng', 'dsr', 'ah', 'esp'],
+    'transport_layer': ['dccp', 'sctp', 'udp', 'udp-lite', 'tcp', 'rtp', 'rtcp'],
+    'session_layer': ['netbios', 'netdump', 'onc-rpc', 'dce', 'rpc', 'dce/rpc', 'http', 'smtp'],
+    'presentation_layer': ['mime'],
+    'application_layer': ['ancp', 'bootp', 'dhcp', 'dns', 'ftp', 'imap', 'iwarp-ddp', 'iwarp-mpa', 'iwarp-rdmap', 'iwarp', 'nntp', 'ntp', 'pana', 'pop', 'radius', 'rlogin', 'rsh', 'rsip', 'ssh', 'snmp', 'telnet', 'tftp', 'sasp', 'data'],
+}
+
+# Dispatch table from a pyshark `layer_name` to its OSI layer, built once at import so classifying a layer is a single dict lookup
+LAYER_NAME_TO_OSI = {layer_name: osi_layer for osi_layer, layer_list in OSI_LAYER_NAMES.items() for layer_name in layer_list if layer_name is not None}
+
+
+def register_layer_name(layer_name: str, osi_layer: str) -> None:
+    """
+    Registers a pyshark layer name with an OSI layer, so new dissectors can be classified without editing the layer classes. A layer name belongs to one OSI layer, registering it again moves it.
+
+    Parameters:
+    - layer_name (str): The pyshark `layer_name`. Exp: `'tls'`.
+    - osi_layer (str): One of the keys of `OSI_LAYER_NAMES`. Exp: `'presentation_layer'`.
+
+    Example:
+    - `register_layer_name('vlan', 'datalink_layer')`
+    """
+    if osi_layer not in OSI_LAYER_NAMES:
+        raise ValueError(f'Unknown OSI layer {osi_layer}, expected one of {list(OSI_LAYER_NAMES)}')
+    previous_osi_layer = LAYER_NAME_TO_OSI.get(layer_name)
+    if previous_osi_layer is not None:
+        OSI_LAYER_NAMES[previous_osi_layer].remove(layer_name)
+    OSI_LAYER_NAMES[osi_layer].append(layer_name)
+    LAYER_NAME_TO_OSI[layer_name] = osi_layer
+
+
+def classify_layer(layer_name: str) -> Optional[str]:
+    """
+    Returns the OSI layer of a pyshark layer name, or `None` if it has not been registered. Exp: `classify_layer('tcp')` returns `'transport_layer'`.
+    """
+    return LAYER_NAME_TO_OSI.get(layer_name)
 
 
 def retrieve_packet(capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> dict:
@@ -26,30 +72,133 @@ def retrieve_packet_layer(layer_list: list[str], packet_dict: dict) -> list:
     """Implements retrieval of a layer from packet data stored in a dictionary.
         Returns:
             List: A list containing values from the specified layer."""
+    layer_set = frozenset(layer_list)
     list_of_eths = []
     for packet in packet_dict:
         for layer in packet_dict[packet]:
-            if layer in layer_list:
+            if layer in layer_set:
                 list_of_eths.append(packet_dict[packet][layer])
     return list_of_eths
 
 
-def retrieve_attribute_from_layer(layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-    layer_dict = {}
-    if attributes_of_layer == None:
-        for i, layer in enumerate(layers):
-            packet_key_name = f'Packet {i + 1}'
-            layer_dict[packet_key_name] = layer._all_fields
-        return layer_dict
+def retrieve_attribute_from_layer(layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None, packet_keys: Optional[list[str]] = None) -> dict:
+    """
+    Retrieves attributes from a list of layers.
+
+    Parameters:
+    - layers: A list of XmlLayer objects.
+    - attributes_of_layer: The attributes to retrieve from each layer. If not provided, all attributes are returned.
+    - packet_keys: The `'Packet N'` key of the packet each layer came from. If not provided, the layers are numbered by their position in the list.
+
+    Returns:
+    - dict: A dictionary where each key is the `'Packet N'` of the layer and the value is a dictionary of its attributes.
+    """
+    with timed('layers.retrieve_attribute_seconds'):
+        if packet_keys is None:
+            packet_keys = [f'Packet {i + 1}' for i in range(len(layers))]
+
+        layer_dict = {}
+        if attributes_of_layer == None:
+            for packet_key_name, layer in zip(packet_keys, layers):
+                layer_dict[packet_key_name] = layer._all_fields
+            return layer_dict
             
-    for i, layer in enumerate(layers):
-        packet_key_name = f'Packet {i + 1}'
-        layer_dict[packet_key_name] = {}
-        for attribute in attributes_of_layer:
-            retrieve_attribute_val = layer.get(attribute, None)
-            if attribute not in layer_dict:
-                layer_dict[packet_key_name].update({attribute: retrieve_attribute_val})
-    return layer_dict
+        for packet_key_name, layer in zip(packet_keys, layers):
+            layer_dict[packet_key_name] = {}
+            for attribute in attributes_of_layer:
+                retrieve_attribute_val = layer.get(attribute, None)
+                if attribute not in layer_dict:
+                    layer_dict[packet_key_name].update({attribute: retrieve_attribute_val})
+        return layer_dict
+
+
+class PacketStore:
+    """
+    Shared store of decoded packets. The capture is walked once and every layer of every packet is bucketed by the OSI layer it belongs to, so each `OSI*Layer` can read its layers from the store instead of walking the capture again.
+
+    Layers are indexed by the `'Packet N'` key of the packet they came from, so a packet without a layer or with two layers of the same OSI layer (Exp: `ip` and `icmp`) does not move the layers of the packets after it. When a packet has more than one layer for an OSI layer or layer name, the first one (the outermost header) is used.
+
+    Parameters:
+    - capture_interface: an object created from one of the pyshark capture classes, or any iterable of packets.
+
+    Example:
+    - `packet_store = PacketStore(live_traffic)` and then `packet_store.get_layer(3, 'ip')`
+    """
+    def __init__(self, capture_interface) -> None:
+        with timed('packet_store.build_seconds'):
+            self.packet_dict = {}
+            self.frame_info = {}
+            self.osi_layers = {osi_layer: {} for osi_layer in OSI_LAYER_NAMES}
+            self.layer_packet_keys = {}
+            for i, packet in enumerate(capture_interface):
+                packet_key_name = f'Packet {i + 1}'
+                self.packet_dict[packet_key_name] = {}
+                self.frame_info[packet_key_name] = {'frame_number': getattr(packet, 'number', None), 'timestamp': getattr(packet, 'sniff_timestamp', None), 'length': getattr(packet, 'length', None)}
+                for layer in packet:
+                    self.packet_dict[packet_key_name].setdefault(f'{layer.layer_name}', layer)
+                for layer_name, layer in self.packet_dict[packet_key_name].items():
+                    self.layer_packet_keys[id(layer)] = packet_key_name
+                    osi_layer = LAYER_NAME_TO_OSI.get(layer_name)
+                    if osi_layer is not None:
+                        self.osi_layers[osi_layer].setdefault(packet_key_name, layer)
+        increment('packet_store.packets', len(self.packet_dict))
+
+
+    def __len__(self) -> int:
+        return len(self.packet_dict)
+
+
+    def get_osi_layers(self, osi_layer: str) -> dict:
+        """
+        Returns the layers bucketed under an OSI layer. Exp: `'datalink_layer'`.
+
+        Returns:
+        - dict: The `'Packet N'` key as the `key` and the layer of that packet as the `value`. Packets without the OSI layer are left out.
+        """
+        return self.osi_layers[osi_layer]
+
+
+    def get_layer(self, packet_num: int, layer_name: str):
+        """
+        Returns a layer of a packet, or `None` if the packet does not have it.
+
+        Parameters:
+        - packet_num (int): The number of the packet in the capture, starting at 1.
+        - layer_name (str): A pyshark layer name (Exp: `'ip'`) or an OSI layer (Exp: `'network_layer'`).
+        """
+        packet_key_name = f'Packet {packet_num}'
+        if layer_name in self.osi_layers:
+            return self.osi_layers[layer_name].get(packet_key_name)
+        return self.packet_dict.get(packet_key_name, {}).get(layer_name)
+
+
+    def get_frame_info(self, packet_num: int) -> dict:
+        """
+        Returns the real frame number and the capture timestamp of a packet. Exp: `{'frame_number': '7', 'timestamp': '1700000000.123'}`.
+        """
+        return self.frame_info[f'Packet {packet_num}']
+
+
+    def get_packet_keys(self, layers: list) -> list[str]:
+        """
+        Returns the `'Packet N'` key of the packet each layer came from.
+        """
+        return [self.layer_packet_keys[id(layer)] for layer in layers]
+
+
+def get_packet_store(capture_interface) -> PacketStore:
+    """
+    Returns the `PacketStore` for a capture interface. If a `PacketStore` is passed in it is returned as is so that it can be shared between all of the `OSI*Layer` classes.
+
+    Parameters:
+    - capture_interface: A `PacketStore` or an object created from one of the pyshark capture classes.
+
+    Returns:
+    - PacketStore: The decoded packets bucketed by OSI layer.
+    """
+    if isinstance(capture_interface, PacketStore):
+        return capture_interface
+    return PacketStore(capture_interface)
 
 
 # Interface template used to create sub classes for different OSI model layers
@@ -87,10 +236,11 @@ class PacketInterface(ABC):
 
 # Indiviual OSI layers
 class OSIPhysicalLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer([None], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('physical_layer').values())
 
     
     def get_packet_layer(self) -> list:
@@ -98,14 +248,15 @@ class OSIPhysicalLayer(PacketInterface):
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSIDataLinkLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['eth', 'arp', 'rarp', 'cslip', 'ppp', 'ppp-mp', 'slip'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('datalink_layer').values())
 
 
     def get_packet_layer(self) -> list:
@@ -113,14 +264,15 @@ class OSIDataLinkLayer(PacketInterface):
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSINetworkLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['ip', 'ipv6', 'icmp', 'icmpv6', 'igmp', 'bgp', 'egp', 'ggp', 'igrp', 'nd', 'ospf', 'rip', 'ripng', 'dsr', 'ah', 'esp'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('network_layer').values())
 
     
     def get_packet_layer(self) -> list:
@@ -128,14 +280,15 @@ class OSINetworkLayer(PacketInterface):
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSITransportLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['dccp', 'sctp', 'udp', 'udp-lite', 'tcp', 'rtp', 'rtcp'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('transport_layer').values())
 
     
     def get_packet_layer(self) -> list:
@@ -143,49 +296,52 @@ class OSITransportLayer(PacketInterface):
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSISessionLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['netbios', 'netdump', 'onc-rpc', 'dce', 'rpc', 'dce/rpc', 'http', 'smtp'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('session_layer').values())
     
     def get_packet_layer(self) -> list:
        return self.list_of_layers
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSIPresentationLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['mime'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('presentation_layer').values())
     
     def get_packet_layer(self) -> list:
        return self.list_of_layers
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 class OSIApplicationLayer(PacketInterface):
-    def __init__(self, capture_interface: Union[pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
+    def __init__(self, capture_interface: Union['PacketStore', pyshark.RemoteCapture, pyshark.FileCapture, pyshark.InMemCapture, pyshark.LiveCapture, pyshark.LiveRingCapture]) -> None:
         self.capture_interface = capture_interface
-        self.packet_dict = retrieve_packet(self.capture_interface)
-        self.list_of_layers = retrieve_packet_layer(['ancp', 'bootp', 'dhcp', 'dns', 'ftp', 'imap', 'iwarp-ddp', 'iwarp-mpa', 'iwarp-rdmap', 'iwarp', 'nntp', 'ntp', 'pana', 'pop', 'radius', 'rlogin', 'rsh', 'rsip', 'ssh', 'snmp', 'telnet', 'tftp', 'sasp', 'data'], self.packet_dict)
+        self.packet_store = get_packet_store(self.capture_interface)
+        self.packet_dict = self.packet_store.packet_dict
+        self.list_of_layers = list(self.packet_store.get_osi_layers('application_layer').values())
     
     def get_packet_layer(self) -> list:
        return self.list_of_layers
 
     
     def get_attribute_from_layer(self, layers: list[pyshark.packet.layers.xml_layer.XmlLayer], attributes_of_layer: Optional[list[str]] = None) -> dict:
-        return retrieve_attribute_from_layer(layers, attributes_of_layer)
+        return retrieve_attribute_from_layer(layers, attributes_of_layer, self.packet_store.get_packet_keys(layers))
 
 
 # Main factory class
@@ -0,0 +1,175 @@
+import ipaddress
+import sqlite3
+from sqlite_connection import TYPED_CONVERTERS, typed_attributes
+
+
+# Column that stores the capture timestamp of a packet, when the table has one
+TIMESTAMP_COLUMN = 'capture_timestamp'
+
+# Columns of packet_info that get a secondary index
+INDEXED_COLUMNS = ('src_ip', 'dest_ip', 'src_port', 'dest_port', 'src_mac', 'dest_mac', TIMESTAMP_COLUMN)
+
+
+def get_table_columns(connection: sqlite3.Connection, table_name: str = 'packet_info') -> list[str]:
+    return [row[1] for row in connection.execute(f'PRAGMA table_info({table_name})')]
+
+
+def get_column_types(connection: sqlite3.Connection, table_name: str = 'packet_info') -> dict:
+    return {row[1]: (row[2] or '').upper() for row in connection.execute(f'PRAGMA table_info({table_name})')}
+
+
+def encode_lookup_value(connection: sqlite3.Connection, column: str, value, table_name: str = 'packet_info'):
+    """
+    Encodes a value the way a column stores it, so lookups work on both schema modes. On a typed schema table (Exp: `src_ip BLOB`) the text value is packed with `sqlite_connection.TYPED_CONVERTERS`, on a text schema table it is used as it is.
+    """
+    if get_column_types(connection, table_name).get(column) == typed_attributes.get(column):
+        return TYPED_CONVERTERS[column](value)
+    return value
+
+
+def create_packet_info_indexes(connection: sqlite3.Connection, table_name: str = 'packet_info') -> list[str]:
+    """
+    Creates the secondary indexes of `packet_info` on IPs, ports, MACs and the capture timestamp. Columns the table does not have are skipped.
+
+    Returns:
+    - `list`: The names of the indexes on the table.
+    """
+    columns = get_table_columns(connection, table_name)
+    index_names = []
+    with connection:
+        for column in INDEXED_COLUMNS:
+            if column in columns:
+                index_name = f'idx_{table_name}_{column}'
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column})')
+                index_names.append(index_name)
+    return index_names
+
+
+def stream_query(connection: sqlite3.Connection, where: str | list, parameters: tuple = (), table_name: str = 'packet_info', after_id: int = 0, page_size: int | None = None, batch_size: int = 1000, order_column: str | None = None, after_value=None, sort_matches: bool = False):
+    """
+    Runs a query over `packet_info` and streams the rows from the cursor instead of loading them all with `fetchall()`.
+
+    Pages are keyed on the order of the rows, so every page starts with an index seek instead of skipping the rows before it. By default rows come in `Packet_ID` order. With `order_column` (Exp: `'capture_timestamp'`) they come in the order of that column, so a range on its index is read in index order instead of being sorted or scanned by rowid.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `where` (str | list): The `WHERE` clause with `?` placeholders. Exp: `'src_port = ?'`. A list of `(where, parameters)` branches that match different rows is run as a `UNION ALL`, where every branch uses its own index and the branches are merged in order. SQLite plans an `OR` over two columns as a multi-index OR that sorts every match before the first row comes back. Exp: `either_column_branches('{column} = ?', (443,), 'src_port', 'dest_port')`.
+    - `parameters` (tuple): The values of the placeholders when `where` is a string.
+    - `table_name` (str): The table to query.
+    - `after_id` (int): Only returns rows after the row with this `Packet_ID`. Pass the `Packet_ID` of the last row of a page to get the next page.
+    - `page_size` (int | None): The maximum number of rows to return. `None` returns every row.
+    - `batch_size` (int): The number of rows fetched from the cursor at a time.
+    - `order_column` (str | None): The column the rows are ordered and paged by, ties are ordered by `Packet_ID`. `None` orders by `Packet_ID`.
+    - `after_value` (any): The `order_column` value of the last row of a page, together with `after_id`. `None` starts at the first row.
+    - `sort_matches` (bool): For branches that are ranges on another index (Exp: an address block). Their matches can not come out in `Packet_ID` order, and SQLite would rather scan the whole table by rowid than sort them. With `sort_matches` the rowid is hidden from the planner, so the range is read from its index and only its matches are sorted.
+
+    Returns:
+    - A generator that yields the rows in `Packet_ID` order, or in `order_column` order.
+
+    Example:
+    - `for row in query_by_port(connection, 443, page_size=100): last_id = row[0]` and then `query_by_port(connection, 443, after_id=last_id, page_size=100)` for the next page.
+    """
+    branches = where if type(where) == list else [(where, parameters)]
+    if order_column is None:
+        key_condition, key_parameters, order_by = f'{"+" if sort_matches else ""}Packet_ID > ?', (after_id,), 'Packet_ID'
+    elif after_value is not None:
+        key_condition, key_parameters, order_by = f'({order_column}, Packet_ID) > (?, ?)', (after_value, after_id), f'{order_column}, Packet_ID'
+    else:
+        key_condition, key_parameters, order_by = None, (), f'{order_column}, Packet_ID'
+
+    selects = []
+    query_parameters = []
+    for branch_where, branch_parameters in branches:
+        # The page key goes first. With two lower bounds on the same index SQLite seeks on the first one, so a late page does not start at the beginning of the range.
+        if key_condition is not None:
+            selects.append(f'SELECT * FROM {table_name} WHERE {key_condition} AND ({branch_where})')
+            query_parameters += [*key_parameters, *branch_parameters]
+        else:
+            selects.append(f'SELECT * FROM {table_name} WHERE ({branch_where})')
+            query_parameters += list(branch_parameters)
+
+    query = ' UNION ALL '.join(selects) + f' ORDER BY {order_by}'
+    if page_size is not None:
+        query += ' LIMIT ?'
+        query_parameters.append(page_size)
+
+    cursor = connection.execute(query, query_parameters)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def either_column_branches(condition: str, parameters: tuple, src_column: str, dest_column: str) -> list[tuple]:
+    """
+    Splits a lookup on the source or the destination column into the two `UNION ALL` branches of `stream_query()`. The destination branch skips rows the source branch already returned, so a packet sent from and to the same value is only returned once.
+
+    Parameters:
+    - `condition` (str): The condition with `{column}` in place of the column name. Exp: `'{column} = ?'`.
+    - `parameters` (tuple): The values of the placeholders of `condition`.
+    - `src_column` (str): The source column. Exp: `'src_ip'`.
+    - `dest_column` (str): The destination column. Exp: `'dest_ip'`.
+
+    Returns:
+    - `list`: The `(where, parameters)` branches.
+    """
+    src_condition = condition.format(column=src_column)
+    dest_condition = condition.format(column=dest_column)
+    return [(src_condition, parameters), (f'{dest_condition} AND NOT coalesce({src_condition}, 0)', (*parameters, *parameters))]
+
+
+def query_by_host(connection: sqlite3.Connection, ip_address: str, **kwargs):
+    """
+    Streams the packets sent from or to an IP address. `**kwargs` are passed to `stream_query()`.
+    """
+    ip_address = encode_lookup_value(connection, 'src_ip', ip_address, kwargs.get('table_name', 'packet_info'))
+    return stream_query(connection, either_column_branches('{column} = ?', (ip_address,), 'src_ip', 'dest_ip'), **kwargs)
+
+
+def query_by_mac(connection: sqlite3.Connection, mac_address: str, **kwargs):
+    """
+    Streams the packets sent from or to a MAC address. `**kwargs` are passed to `stream_query()`.
+    """
+    mac_address = encode_lookup_value(connection, 'src_mac', mac_address, kwargs.get('table_name', 'packet_info'))
+    return stream_query(connection, either_column_branches('{column} = ?', (mac_address,), 'src_mac', 'dest_mac'), **kwargs)
+
+
+def query_by_port(connection: sqlite3.Connection, port: int, **kwargs):
+    """
+    Streams the packets sent from or to a port. `**kwargs` are passed to `stream_query()`.
+    """
+    return stream_query(connection, either_column_branches('{column} = ?', (port,), 'src_port', 'dest_port'), **kwargs)
+
+
+def query_by_time_range(connection: sqlite3.Connection, start_time: float, end_time: float, **kwargs):
+    """
+    Streams the packets captured from `start_time` up to, but not including, `end_time`, in capture time order. Only works on tables that have a `capture_timestamp` column. `**kwargs` are passed to `stream_query()`.
+
+    Example:
+    - Pass `after_value=row[index_of_capture_timestamp], after_id=row[0]` of the last row of a page to get the next page.
+    """
+    if TIMESTAMP_COLUMN not in get_table_columns(connection, kwargs.get('table_name', 'packet_info')):
+        raise ValueError(f'The table has no {TIMESTAMP_COLUMN} column to query by time range')
+    kwargs.setdefault('order_column', TIMESTAMP_COLUMN)
+    return stream_query(connection, f'{TIMESTAMP_COLUMN} >= ? AND {TIMESTAMP_COLUMN} < ?', (start_time, end_time), **kwargs)
+
+
+def query_by_network(connection: sqlite3.Connection, network: str, **kwargs):
+    """
+    Streams the packets sent from or to an address block. Only works on tables that use the typed schema, where IPs are packed 16 byte blobs that sort in address order, so the block is an index range on `src_ip` and `dest_ip`. The matches of the ranges are sorted into `Packet_ID` order. `**kwargs` are passed to `stream_query()`.
+
+    Parameters:
+    - `network` (str): The address block. Exp: `'10.0.0.0/8'` or `'fd00::/8'`.
+    """
+    table_name = kwargs.get('table_name', 'packet_info')
+    if get_column_types(connection, table_name).get('src_ip') != typed_attributes['src_ip']:
+        raise ValueError('The table does not store packed IPs to query by network, use the typed schema')
+    network = ipaddress.ip_network(network, strict=False)
+    low = encode_lookup_value(connection, 'src_ip', str(network.network_address), table_name)
+    high = encode_lookup_value(connection, 'src_ip', str(network.broadcast_address), table_name)
+    kwargs.setdefault('sort_matches', True)
+    return stream_query(connection, either_column_branches('{column} BETWEEN ? AND ?', (low, high), 'src_ip', 'dest_ip'), **kwargs)
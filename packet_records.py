@@ -0,0 +1,255 @@
+from array import array
+import ipaddress
+
+
+# Column types that are stored packed instead of as strings
+COLUMN_TYPES = ('mac', 'ip', 'port', 'text')
+
+IPV4_MAPPED_PREFIX = bytes(10) + b'\xff\xff'
+
+
+def infer_column_type(attribute: str) -> str:
+    """
+    Works out which column type an attribute should be stored as.
+
+    Parameters:
+    - `attribute` (str): An attribute from the attribute dict. Exp: `'network_layer.src'`.
+
+    Returns:
+    - `str`: One of `COLUMN_TYPES`. MACs and IPs are the `src`/`dst` attributes of the datalink and network layers, ports are the attributes ending in `port`.
+    """
+    layer_name, _, field_name = attribute.partition('.')
+    if layer_name == 'datalink_layer' and field_name in ('src', 'dst'):
+        return 'mac'
+    if layer_name == 'network_layer' and field_name in ('src', 'dst'):
+        return 'ip'
+    if field_name.endswith('port'):
+        return 'port'
+    return 'text'
+
+
+def pack_mac(value: str) -> bytes:
+    packed = bytes.fromhex(value.replace(':', '').replace('-', ''))
+    if len(packed) != 6:
+        raise ValueError(f'{value} is not a MAC address')
+    return packed
+
+
+def unpack_mac(packed: bytes) -> str:
+    return ':'.join(f'{byte:02x}' for byte in packed)
+
+
+def mac_to_int(value: str) -> int:
+    """
+    Packs a MAC address into a 48-bit integer, the form the typed schema of `sqlite_connection` stores it in.
+    """
+    return int.from_bytes(pack_mac(value), 'big')
+
+
+def int_to_mac(value: int) -> str:
+    return unpack_mac(value.to_bytes(6, 'big'))
+
+
+def pack_ip(value: str) -> bytes:
+    """
+    Packs an IPv4 or IPv6 address into 16 bytes. IPv4 addresses are stored as IPv4-mapped IPv6 addresses so every address has the same width.
+    """
+    address = ipaddress.ip_address(value)
+    if address.version == 4:
+        return IPV4_MAPPED_PREFIX + address.packed
+    return address.packed
+
+
+def unpack_ip(packed: bytes) -> str:
+    address = ipaddress.IPv6Address(packed)
+    if address.ipv4_mapped is not None:
+        return str(address.ipv4_mapped)
+    return str(address)
+
+
+def pack_port(value) -> int:
+    port = int(value)
+    if not 0 <= port <= 0xFFFF:
+        raise ValueError(f'{value} is not a port')
+    return port
+
+
+class PacketColumn:
+    """
+    A single typed column of the `PacketRecords` store.
+
+    MACs are stored as 6 bytes and IPs as 16 bytes in one `bytearray`, ports in a uint16 `array` and everything else in a list. A `bytearray` marks which rows have a value. Values that cannot be packed (Exp: a `datalink_layer.src` that is not a MAC) are kept as is in `overflow` so no data is lost.
+    """
+    __slots__ = ('column_type', 'values', 'present', 'overflow')
+
+    PACKED_WIDTHS = {'mac': 6, 'ip': 16}
+
+    def __init__(self, column_type: str) -> None:
+        if column_type not in COLUMN_TYPES:
+            raise ValueError(f'Unknown column type {column_type}, expected one of {COLUMN_TYPES}')
+        self.column_type = column_type
+        if column_type in self.PACKED_WIDTHS:
+            self.values = bytearray()
+        elif column_type == 'port':
+            self.values = array('H')
+        else:
+            self.values = []
+        self.present = bytearray()
+        self.overflow = {}
+
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+
+    def append(self, value) -> None:
+        index = len(self.present)
+        packed = None
+        if value is not None:
+            try:
+                if self.column_type == 'mac':
+                    packed = pack_mac(value)
+                elif self.column_type == 'ip':
+                    packed = pack_ip(value)
+                elif self.column_type == 'port':
+                    packed = pack_port(value)
+                else:
+                    packed = value
+            except ValueError:
+                self.overflow[index] = value
+
+        if self.column_type in self.PACKED_WIDTHS:
+            self.values += packed if isinstance(packed, bytes) else bytes(self.PACKED_WIDTHS[self.column_type])
+        elif self.column_type == 'port':
+            self.values.append(packed if packed is not None else 0)
+        else:
+            self.values.append(packed)
+        self.present.append(packed is not None)
+
+
+    def extend(self, other: 'PacketColumn') -> None:
+        """
+        Appends every row of another column of the same type.
+        """
+        if other.column_type != self.column_type:
+            raise ValueError(f'Cannot extend a {self.column_type} column with a {other.column_type} column')
+        offset = len(self.present)
+        self.values += other.values
+        self.present += other.present
+        self.overflow.update({index + offset: value for index, value in other.overflow.items()})
+
+
+    def get(self, index: int):
+        """
+        Returns the value of a row unpacked back into the form it had in the attribute dict, or `None` if the row has no value.
+        """
+        if not self.present[index]:
+            return self.overflow.get(index)
+        if self.column_type in self.PACKED_WIDTHS:
+            width = self.PACKED_WIDTHS[self.column_type]
+            packed = bytes(self.values[index * width:(index + 1) * width])
+            return unpack_mac(packed) if self.column_type == 'mac' else unpack_ip(packed)
+        return self.values[index]
+
+
+class PacketRecords:
+    """
+    Columnar store of packet attributes. Replaces the `'Packet N'` -> layer -> field nested dicts with one typed `PacketColumn` per attribute, indexed by an integer packet index (`0` is `'Packet 1'`).
+
+    Parameters:
+    - `attributes` (list | tuple): The attributes to store, in column order. Exp: `list_of_attributes_to_add`.
+    - `column_types` (dict | None): Overrides the column type for specific attributes. Exp: `{'network_layer.ttl': 'port'}`. By default the type comes from `infer_column_type()`.
+
+    Example:
+    - `records = PacketRecords.from_attribute_dict(combine_dict, list_of_attributes_to_add)` and then `writer.add_rows(records.rows())`
+    """
+    __slots__ = ('attributes', 'columns')
+
+    def __init__(self, attributes: list | tuple, column_types: dict | None = None) -> None:
+        column_types = column_types or {}
+        self.attributes = tuple(attributes)
+        self.columns = {attribute: PacketColumn(column_types.get(attribute, infer_column_type(attribute))) for attribute in self.attributes}
+
+
+    @classmethod
+    def from_attribute_dict(cls, attribute_dict: dict, attributes: list | tuple, column_types: dict | None = None) -> 'PacketRecords':
+        """
+        Builds the store from a dict with the same structure as `combine_dict`.
+        """
+        records = cls(attributes, column_types)
+        for packet_data in attribute_dict.values():
+            records.append(packet_data)
+        return records
+
+
+    def __len__(self) -> int:
+        return len(self.columns[self.attributes[0]]) if self.attributes else 0
+
+
+    def append(self, packet_data: dict) -> int:
+        """
+        Adds one packet to the store. Only the attributes of the store are kept, the same as `only_grab_specific_attributes()`.
+
+        Parameters:
+        - `packet_data` (dict): The layers of one packet. Exp: `combine_dict['Packet 1']`.
+
+        Returns:
+        - `int`: The index of the packet in the store.
+        """
+        values = {}
+        for layer_value in packet_data.values():
+            if layer_value is not None:
+                for key, value in layer_value.items():
+                    if key in self.columns:
+                        values[key] = value
+        for attribute, column in self.columns.items():
+            column.append(values.get(attribute))
+        return len(self) - 1
+
+
+    def extend(self, other: 'PacketRecords') -> None:
+        """
+        Appends every packet of another store with the same attributes. Used to merge stores that were built in different processes.
+        """
+        if other.attributes != self.attributes:
+            raise ValueError('Cannot extend PacketRecords that have different attributes')
+        for attribute, column in self.columns.items():
+            column.extend(other.columns[attribute])
+
+
+    def get(self, index: int, attribute: str):
+        return self.columns[attribute].get(index)
+
+
+    def select(self, search_for_iterable: list | tuple | set) -> 'PacketRecords':
+        """
+        Returns a store that only has the requested attributes. The columns are shared with this store, not copied.
+        """
+        subset = PacketRecords(())
+        subset.attributes = tuple(attribute for attribute in self.attributes if attribute in search_for_iterable)
+        subset.columns = {attribute: self.columns[attribute] for attribute in subset.attributes}
+        return subset
+
+
+    def packet_dict(self, index: int) -> dict:
+        """
+        Returns one packet in the same structure as the values from `only_grab_specific_attributes()`.
+        """
+        packet_data = {}
+        for attribute in self.attributes:
+            value = self.get(index, attribute)
+            if value is not None:
+                packet_data.setdefault(attribute.partition('.')[0], {})[attribute] = value
+        return packet_data
+
+
+    def rows(self, attributes: list | tuple | None = None):
+        """
+        Yields each packet as a tuple of values in column order, ready to be inserted into the database.
+
+        Parameters:
+        - `attributes` (list | tuple | None): The attributes to yield, in column order. Defaults to the attributes of the store. Attributes the store does not have are `None`.
+        """
+        columns = [self.columns.get(attribute) for attribute in (attributes or self.attributes)]
+        for index in range(len(self)):
+            yield tuple(column.get(index) if column is not None else None for column in columns)
@@ -0,0 +1,240 @@
+from contextlib import nullcontext
+import logging
+import os
+import threading
+import time
+
+
+# Upper bounds in seconds of the timing histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# Returned from `timed()` while metrics are disabled, so a disabled timer costs a single function call
+NULL_TIMER = nullcontext()
+
+_registry = None
+
+
+class Histogram:
+    """
+    Timing histogram with fixed bucket upper bounds. `counts[i]` is the number of observations that fit in `buckets[i]`, the last count is for everything above the largest bucket.
+    """
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+    def as_dict(self) -> dict:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.total, 'count': self.count}
+
+
+class Timer:
+    """
+    Context manager that adds the seconds spent inside it to a histogram of the registry.
+    """
+    __slots__ = ('registry', 'name', 'start_time')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str) -> None:
+        self.registry = registry
+        self.name = name
+
+
+    def __enter__(self) -> 'Timer':
+        self.start_time = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.registry.observe(self.name, time.perf_counter() - self.start_time)
+
+
+class MetricsRegistry:
+    """
+    Holds the counters, timing histograms and gauges (Exp: queue depths) of the pipeline and hands snapshots of them to the sinks.
+
+    Parameters:
+    - `sinks` (list): Objects with an `emit(snapshot)` method. Exp: `[LogSink(), PrometheusTextFileSink('pipeline.prom')]`.
+    - `flush_interval` (float | None): Seconds between automatic flushes to the sinks. `None` only flushes when `flush()` is called.
+    """
+    def __init__(self, sinks: list, flush_interval: float | None = None) -> None:
+        self.sinks = list(sinks)
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.maybe_flush()
+
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+        self.maybe_flush()
+
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'timestamp': time.time(),
+                    'counters': dict(self.counters),
+                    'histograms': {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+                    'gauges': dict(self.gauges)
+                    }
+
+
+    def maybe_flush(self) -> None:
+        if self.flush_interval is not None and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+
+
+class LogSink:
+    """
+    Writes every snapshot as a log line.
+    """
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO) -> None:
+        self.logger = logger or logging.getLogger('pipeline_metrics')
+        self.level = level
+
+
+    def emit(self, snapshot: dict) -> None:
+        timings = {name: round(histogram['sum'] / histogram['count'], 6) for name, histogram in snapshot['histograms'].items() if histogram['count']}
+        self.logger.log(self.level, 'counters=%s mean_seconds=%s gauges=%s', snapshot['counters'], timings, snapshot['gauges'])
+
+
+class PrometheusTextFileSink:
+    """
+    Writes every snapshot to a file in the Prometheus text format, for the node exporter textfile collector. The file is replaced atomically so it is never read half written.
+    """
+    def __init__(self, file_path: str, prefix: str = 'wireshark_capture') -> None:
+        self.file_path = file_path
+        self.prefix = prefix
+
+
+    def metric_name(self, name: str) -> str:
+        return f'{self.prefix}_' + ''.join(char if char.isalnum() else '_' for char in name)
+
+
+    def emit(self, snapshot: dict) -> None:
+        lines = []
+        for name, value in snapshot['counters'].items():
+            metric_name = self.metric_name(name)
+            lines += [f'# TYPE {metric_name}_total counter', f'{metric_name}_total {value}']
+        for name, value in snapshot['gauges'].items():
+            metric_name = self.metric_name(name)
+            lines += [f'# TYPE {metric_name} gauge', f'{metric_name} {value}']
+        for name, histogram in snapshot['histograms'].items():
+            metric_name = self.metric_name(name)
+            lines.append(f'# TYPE {metric_name} histogram')
+            cumulative_count = 0
+            for upper_bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative_count += count
+                lines.append(f'{metric_name}_bucket{{le="{upper_bound}"}} {cumulative_count}')
+            lines += [f'{metric_name}_bucket{{le="+Inf"}} {histogram["count"]}', f'{metric_name}_sum {histogram["sum"]}', f'{metric_name}_count {histogram["count"]}']
+
+        temp_path = f'{self.file_path}.tmp'
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.file_path)
+
+
+class CallbackSink:
+    """
+    Hands every snapshot to a callback. Exp: `CallbackSink(snapshots.append)`.
+    """
+    def __init__(self, callback) -> None:
+        self.callback = callback
+
+
+    def emit(self, snapshot: dict) -> None:
+        self.callback(snapshot)
+
+
+def enable_metrics(*sinks, flush_interval: float | None = None) -> MetricsRegistry:
+    """
+    Turns instrumentation on for the whole pipeline.
+
+    Parameters:
+    - `*sinks`: The sinks the snapshots are handed to. Exp: `enable_metrics(LogSink(), flush_interval=10)`.
+    - `flush_interval` (float | None): Seconds between automatic flushes. `None` only flushes when `flush_metrics()` is called.
+
+    Returns:
+    - `MetricsRegistry`: The registry that now collects the metrics.
+    """
+    global _registry
+    _registry = MetricsRegistry(list(sinks), flush_interval)
+    return _registry
+
+
+def disable_metrics() -> None:
+    """
+    Turns instrumentation off. Every hook goes back to costing a single function call.
+    """
+    global _registry
+    _registry = None
+
+
+def get_registry() -> MetricsRegistry | None:
+    return _registry
+
+
+def flush_metrics() -> None:
+    if _registry is not None:
+        _registry.flush()
+
+
+def timed(name: str):
+    """
+    Times the code inside it into the histogram `name`. Exp: `with timed('capture.sniff_seconds'): ...`.
+    """
+    if _registry is None:
+        return NULL_TIMER
+    return Timer(_registry, name)
+
+
+def increment(name: str, value: int = 1) -> None:
+    if _registry is not None:
+        _registry.increment(name, value)
+
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Adds a duration that was measured by hand to the histogram `name`, for code `timed()` can not wrap. Exp: the decoding inside a generator, without the time its consumer takes.
+    """
+    if _registry is not None:
+        _registry.observe(name, seconds)
+
+
+def set_gauge(name: str, value: float) -> None:
+    if _registry is not None:
+        _registry.set_gauge(name, value)
@@ -0,0 +1,273 @@
+import heapq
+import mmap
+import socket
+import struct
+import time
+from capture_traffic_functions import grab_packet_attributes, instantiate_all_osi_layers, stream_attributes
+from pipeline_metrics import increment, observe
+
+
+# Attributes the raw decoder can fill in. Any other attribute sends the whole file through pyshark.
+FAST_ATTRIBUTES = frozenset({'datalink_layer.src', 'datalink_layer.dst',
+                             'network_layer.src', 'network_layer.dst', 'network_layer.proto', 'network_layer.nxt',
+                             'transport_layer.srcport', 'transport_layer.dstport',
+                             'frame.timestamp', 'frame.length'})
+
+# Link types that are decoded. Raw IP link types have no datalink layer.
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (101, 228, 229)
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_ARP = 0x0806
+
+IP_PROTOCOL_TCP = 6
+IP_PROTOCOL_UDP = 17
+
+# IPv6 extension headers that are skipped to find the transport header. Fragments (44) and AH (51) are left to pyshark.
+IPV6_EXTENSION_HEADERS = frozenset({0, 43, 60})
+IPV6_UNDECODED_HEADERS = frozenset({44, 51})
+
+# IP-in-IP (4), IPv6-in-IPv4 (41) and GRE (47) carry another IP packet. pyshark takes the TCP/UDP header inside it as the transport layer, so these are left to pyshark when transport attributes are asked for.
+IP_TUNNEL_PROTOCOLS = frozenset({4, 41, 47})
+
+# The first four bytes of a pcap file, with the byte order and the number of timestamp units per second
+PCAP_MAGIC_NUMBERS = {b'\xd4\xc3\xb2\xa1': ('<', 6), b'\xa1\xb2\xc3\xd4': ('>', 6), b'\x4d\x3c\xb2\xa1': ('<', 9), b'\xa1\xb2\x3c\x4d': ('>', 9)}
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+
+
+def format_mac(data, offset: int) -> str:
+    return data[offset:offset + 6].hex(':')
+
+
+def format_timestamp(units: int, resolution: tuple) -> str:
+    """
+    Formats a timestamp the way pyshark's `sniff_timestamp` is, in seconds with nine decimals. Exp: `'1700000000.000001000'`.
+
+    Parameters:
+    - `units` (int): The timestamp in units of the resolution.
+    - `resolution` (tuple): `(10, 6)` for microseconds, `(2, 20)` for units of 2^-20 seconds, ...
+    """
+    base, exponent = resolution
+    if base == 10 and exponent <= 9:
+        seconds, fraction = divmod(units, 10 ** exponent)
+        return f'{seconds}.{fraction * 10 ** (9 - exponent):09d}'
+    return f'{units / base ** exponent:.9f}'
+
+
+def iter_pcap_frames(data, byte_order: str, exponent: int):
+    """
+    Yields `(link_type, timestamp, original_length, frame)` for every record of a pcap file.
+    """
+    link_type = struct.unpack_from(f'{byte_order}I', data, 20)[0] & 0xFFFF
+    record_header = struct.Struct(f'{byte_order}IIII')
+    offset = 24
+    while offset + 16 <= len(data):
+        seconds, fraction, captured_length, original_length = record_header.unpack_from(data, offset)
+        offset += 16
+        yield link_type, format_timestamp(seconds * 10 ** exponent + fraction, (10, exponent)), original_length, data[offset:offset + captured_length]
+        offset += captured_length
+
+
+def iter_pcapng_frames(data):
+    """
+    Yields `(link_type, timestamp, original_length, frame)` for every packet block of a pcapng file. Blocks that are not decoded (Exp: the obsolete Packet Block) yield `None` as the frame, so pyshark handles them.
+    """
+    offset = 0
+    byte_order = '<'
+    interfaces = []
+    while offset + 12 <= len(data):
+        block_type = struct.unpack_from(f'{byte_order}I', data, offset)[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            byte_order = '<' if struct.unpack_from('<I', data, offset + 8)[0] == 0x1A2B3C4D else '>'
+            interfaces = []
+        block_length = struct.unpack_from(f'{byte_order}I', data, offset + 4)[0]
+        if block_length < 12:
+            break
+
+        if block_type == 1:
+            link_type = struct.unpack_from(f'{byte_order}H', data, offset + 8)[0]
+            resolution = (10, 6)
+            option_offset = offset + 16
+            while option_offset + 4 <= offset + block_length - 4:
+                option_code, option_length = struct.unpack_from(f'{byte_order}HH', data, option_offset)
+                if option_code == 0:
+                    break
+                if option_code == 9:
+                    tsresol = data[option_offset + 4]
+                    resolution = (2, tsresol & 0x7F) if tsresol & 0x80 else (10, tsresol)
+                option_offset += 4 + (option_length + 3) // 4 * 4
+            interfaces.append((link_type, resolution))
+        elif block_type == 6:
+            interface_id, timestamp_high, timestamp_low, captured_length, original_length = struct.unpack_from(f'{byte_order}IIIII', data, offset + 8)
+            link_type, resolution = interfaces[interface_id]
+            yield link_type, format_timestamp(timestamp_high << 32 | timestamp_low, resolution), original_length, data[offset + 28:offset + 28 + captured_length]
+        elif block_type == 3:
+            original_length = struct.unpack_from(f'{byte_order}I', data, offset + 8)[0]
+            captured_length = min(original_length, block_length - 16)
+            yield interfaces[0][0], None, original_length, data[offset + 12:offset + 12 + captured_length]
+        elif block_type == 2:
+            yield None, None, None, None
+        offset += block_length
+
+
+def iter_capture_frames(data):
+    """
+    Yields `(link_type, timestamp, original_length, frame)` for every frame of a pcap or pcapng file, in frame order.
+    """
+    magic_number = data[:4]
+    if len(magic_number) < 4:
+        raise ValueError('Not a pcap or pcapng file')
+    if magic_number in PCAP_MAGIC_NUMBERS:
+        return iter_pcap_frames(data, *PCAP_MAGIC_NUMBERS[magic_number])
+    if struct.unpack('<I', magic_number)[0] == PCAPNG_SECTION_HEADER:
+        return iter_pcapng_frames(data)
+    raise ValueError('Not a pcap or pcapng file')
+
+
+def decode_frame(link_type: int, timestamp: str | None, original_length: int, frame, needs_transport: bool) -> dict | None:
+    """
+    Decodes the Ethernet, IPv4/IPv6 and TCP/UDP headers of a frame into the same layers `capture_traffic_functions.extract_packet_attributes()` returns once its keys are renamed.
+
+    Parameters:
+    - `needs_transport` (bool): Whether transport attributes were asked for. Packets whose transport layer tshark would reassemble (Exp: an IP fragment) can only be decoded here when it was not, and so can tunnelled packets (`IP_TUNNEL_PROTOCOLS`), where pyshark finds the TCP/UDP header of the inner packet. Other packets that are neither TCP nor UDP (Exp: ICMP) get an empty transport layer, the same as `PacketStore` finds for them.
+
+    Returns:
+    - `dict`: The layers of the packet. `None` if the frame has to be decoded by pyshark instead.
+    """
+    if frame is None or timestamp is None:
+        return None
+    packet_data = {'frame': {'frame.timestamp': timestamp, 'frame.length': str(original_length)}}
+
+    if link_type == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        ether_type = struct.unpack_from('!H', frame, 12)[0]
+        packet_data['datalink_layer'] = {'datalink_layer.src': format_mac(frame, 6), 'datalink_layer.dst': format_mac(frame, 0)}
+        if ether_type == ETHERTYPE_ARP:
+            return packet_data
+        offset = 14
+    elif link_type in LINKTYPE_RAW:
+        if not len(frame):
+            return None
+        ether_type = ETHERTYPE_IPV4 if frame[0] >> 4 == 4 else ETHERTYPE_IPV6
+        offset = 0
+    else:
+        return None
+
+    if ether_type == ETHERTYPE_IPV4:
+        if len(frame) < offset + 20 or frame[offset] >> 4 != 4:
+            return None
+        header_length = (frame[offset] & 0x0F) * 4
+        fragment = struct.unpack_from('!H', frame, offset + 6)[0] & 0x3FFF
+        protocol = frame[offset + 9]
+        packet_data['network_layer'] = {'network_layer.src': socket.inet_ntop(socket.AF_INET, frame[offset + 12:offset + 16]),
+                                        'network_layer.dst': socket.inet_ntop(socket.AF_INET, frame[offset + 16:offset + 20]),
+                                        'network_layer.proto': str(protocol)}
+        if fragment:
+            return None if needs_transport else packet_data
+        offset += header_length
+    elif ether_type == ETHERTYPE_IPV6:
+        if len(frame) < offset + 40 or frame[offset] >> 4 != 6:
+            return None
+        protocol = frame[offset + 6]
+        packet_data['network_layer'] = {'network_layer.src': socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24]),
+                                        'network_layer.dst': socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40]),
+                                        'network_layer.nxt': str(protocol)}
+        offset += 40
+        while protocol in IPV6_EXTENSION_HEADERS and len(frame) >= offset + 2:
+            protocol, extension_length = frame[offset], frame[offset + 1]
+            offset += (extension_length + 1) * 8
+    else:
+        return None
+
+    if protocol in (IP_PROTOCOL_TCP, IP_PROTOCOL_UDP):
+        if len(frame) < offset + 4:
+            return None if needs_transport else packet_data
+        src_port, dst_port = struct.unpack_from('!HH', frame, offset)
+        packet_data['transport_layer'] = {'transport_layer.srcport': str(src_port), 'transport_layer.dstport': str(dst_port)}
+    elif needs_transport and (protocol in IPV6_UNDECODED_HEADERS or protocol in IP_TUNNEL_PROTOCOLS):
+        return None
+    return packet_data
+
+
+def stream_raw_attributes(file_path: str, search_for_iterable: list|tuple|set, num_packets: int | None = None, max_fallback_frames: int = 10000, **kwargs):
+    """
+    Fast path for capture files that reads the common headers straight out of a memory mapped pcap or pcapng file instead of going through tshark. Frames it can not decode (Exp: other link types, IP fragments) are decoded by pyshark in a single extra pass and merged back in frame order.
+
+    Parameters:
+    - `file_path` (str): The pcap or pcapng file to read.
+    - `search_for_iterable`: The attributes to grab. Exp: `list_of_attributes_to_add`. If one is not in `FAST_ATTRIBUTES` the whole file is read with pyshark.
+    - `num_packets` (int | None): The number of frames to read. `None` reads the whole file.
+    - `max_fallback_frames` (int): The number of frames pyshark can be asked for by frame number. When more frames need pyshark, the whole file is read with pyshark.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture` when pyshark is used. A `display_filter` is combined with `and` with the frame numbers pyshark is asked for. The fast path does not evaluate display filters.
+
+    Returns:
+    - A generator that yields the same `('Packet N', packet_data)` tuples as `capture_traffic_functions.stream_attributes()`.
+    """
+    if not set(search_for_iterable) <= FAST_ATTRIBUTES:
+        yield from stream_pyshark_attributes(file_path, search_for_iterable, num_packets, **kwargs)
+        return
+    needs_transport = any(attribute.startswith('transport_layer.') for attribute in search_for_iterable)
+
+    with open(file_path, 'rb') as capture_file:
+        if capture_file.seek(0, 2) == 0:
+            return
+        # Slicing the mmap copies only the frame, so no view of the map is left open when the generator is closed early
+        with mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            fallback_frames = []
+            for frame_number, frame_fields in enumerate(iter_capture_frames(data), start=1):
+                if num_packets is not None and frame_number > num_packets:
+                    break
+                if decode_frame(*frame_fields, needs_transport) is None:
+                    fallback_frames.append(frame_number)
+                if len(fallback_frames) > max_fallback_frames:
+                    yield from stream_pyshark_attributes(file_path, search_for_iterable, num_packets, **kwargs)
+                    return
+
+            def decode_fast_frames():
+                # Only the decoding is timed, not the time the consumer spends between two frames
+                decode_seconds = 0.0
+                start_time = time.perf_counter()
+                try:
+                    for frame_number, frame_fields in enumerate(iter_capture_frames(data), start=1):
+                        if num_packets is not None and frame_number > num_packets:
+                            break
+                        packet_data = decode_frame(*frame_fields, needs_transport)
+                        if packet_data is not None:
+                            increment('raw_decoder.fast_packets')
+                            packet = (f'Packet {frame_number}', grab_packet_attributes(packet_data, search_for_iterable))
+                            decode_seconds += time.perf_counter() - start_time
+                            yield frame_number, packet
+                            start_time = time.perf_counter()
+                    decode_seconds += time.perf_counter() - start_time
+                finally:
+                    observe('raw_decoder.decode_seconds', decode_seconds)
+
+            def decode_fallback_frames():
+                if not fallback_frames:
+                    return
+                fallback_kwargs = dict(kwargs)
+                display_filter = 'frame.number in {' + ' '.join(map(str, fallback_frames)) + '}'
+                if fallback_kwargs.get('display_filter'):
+                    display_filter = f'({fallback_kwargs["display_filter"]}) and {display_filter}'
+                fallback_kwargs['display_filter'] = display_filter
+                for packet_key_name, packet_data in stream_pyshark_attributes(file_path, search_for_iterable, **fallback_kwargs):
+                    increment('raw_decoder.fallback_packets')
+                    yield int(packet_key_name.split(' ')[1]), (packet_key_name, packet_data)
+
+            for frame_number, packet in heapq.merge(decode_fast_frames(), decode_fallback_frames(), key=lambda item: item[0]):
+                yield packet
+
+
+def stream_pyshark_attributes(file_path: str, search_for_iterable: list|tuple|set, num_packets: int | None = None, **kwargs):
+    """
+    Reads a capture file through pyshark, the same as the rest of the pipeline. Used by `stream_raw_attributes()` for what it can not decode.
+    """
+    import pyshark
+
+    capture = pyshark.FileCapture(input_file=file_path, keep_packets=False, **kwargs)
+    try:
+        yield from stream_attributes(capture, instantiate_all_osi_layers(), search_for_iterable, num_packets)
+    finally:
+        capture.close()
@@ -0,0 +1,271 @@
+import glob
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from capture_traffic import list_of_attributes_to_add
+from capture_traffic_functions import instantiate_all_osi_layers, stream_attributes
+from pipeline_metrics import increment, set_gauge
+from raw_pcap_decoder import iter_capture_frames
+from sqlite_connection import PacketInfoWriter, attributes, create_packet_info_table, map_attributes_order, packet_to_row
+
+
+def list_ring_files(ring_file_name: str) -> list[str]:
+    """
+    Lists the ring files written for a `ring_file_name`, oldest first. dumpcap and tshark name them `<name>_<number>_<timestamp><extension>`.
+
+    Parameters:
+    - `ring_file_name` (str): The `ring_file_name` passed to `RingSpool`. Exp: `'spool/capture.pcapng'` lists `'spool/capture_00001_20240101120000.pcapng'`, ...
+    """
+    stem, extension = os.path.splitext(ring_file_name)
+    ring_files = []
+    for file_path in glob.glob(f'{glob.escape(stem)}_*{extension}'):
+        file_number = file_path[len(stem) + 1:].split('_')[0]
+        if file_number.isdigit():
+            ring_files.append((int(file_number), file_path))
+    return [file_path for file_number, file_path in sorted(ring_files)]
+
+
+def count_capture_frames(file_path: str) -> int:
+    """
+    Counts the frames of a pcap or pcapng file from its record headers, without decoding them.
+    """
+    with open(file_path, 'rb') as capture_file:
+        if capture_file.seek(0, 2) == 0:
+            return 0
+        with mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            num_of_frames = 0
+            try:
+                for frame_fields in iter_capture_frames(data):
+                    num_of_frames += 1
+            except struct.error:
+                # A truncated last block, Exp: the capture program was killed while writing it
+                pass
+            return num_of_frames
+
+
+def find_capture_program() -> str:
+    """
+    Returns the program that writes the ring files. `dumpcap` only captures, `tshark` is used when it is not on the `PATH`.
+    """
+    for program in ('dumpcap', 'tshark'):
+        program_path = shutil.which(program)
+        if program_path is not None:
+            return program_path
+    raise FileNotFoundError('Neither dumpcap nor tshark was found on the PATH')
+
+
+class RingSpool:
+    """
+    Runs `dumpcap` (or `tshark -w`) as a plain subprocess that writes ring files. Nothing is decoded while capturing, every packet is only decoded once, when its ring file is ingested. The capture program never keeps more than `num_ring_files` files of `ring_file_size` kilobytes, which caps the disk used by the spool.
+
+    Parameters:
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `ring_file_name` (str): The path of the ring files. Exp: `'spool/capture.pcapng'`.
+    - `ring_file_size` (int): The size of a ring file in kilobytes.
+    - `num_ring_files` (int): The number of ring files that are kept before the oldest one is deleted.
+    - `bpf_filter` (str | None): A capture filter. Exp: `'tcp port 443'`.
+    - `capture_program` (str | None): The path of `dumpcap` or `tshark`. Defaults to `find_capture_program()`.
+    """
+    def __init__(self, interface: str, ring_file_name: str, ring_file_size: int = 10240, num_ring_files: int = 8, bpf_filter: str | None = None, capture_program: str | None = None) -> None:
+        self.command = [capture_program or find_capture_program(), '-i', interface, '-q', '-w', ring_file_name, '-b', f'filesize:{ring_file_size}', '-b', f'files:{num_ring_files}']
+        if bpf_filter:
+            self.command += ['-f', bpf_filter]
+        self.process = None
+        self.error = None
+        self.error_output = None
+
+
+    def start(self) -> 'RingSpool':
+        self.error_output = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(self.command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=self.error_output)
+        return self
+
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stops the capture program, which closes the ring file it is writing, and waits for it to exit. An exit code other than a normal stop is stored in `error`.
+        """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        elif self.process.returncode != 0:
+            self.error_output.seek(0)
+            self.error = RuntimeError(f'{os.path.basename(self.command[0])} exited with {self.process.returncode}: {self.error_output.read().decode(errors="replace").strip()}')
+        self.error_output.close()
+
+
+def ingest_ring_file(writer: PacketInfoWriter, file_path: str, osi_layers: dict, attributes_to_add: list | tuple, mapping_attributes_order: dict, num_cols: int, **kwargs) -> int:
+    """
+    Streams the packets of a completed ring file into a writer. Only one packet of the file is held in memory at a time.
+
+    Parameters:
+    - `writer` (PacketInfoWriter): The writer of the `packet_info` table.
+    - `file_path` (str): The ring file to ingest.
+    - `osi_layers` (dict): The dict returned from the `instantiate_osi_layers()`.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns.
+    - `mapping_attributes_order` (dict): The dict returned from the `map_attributes_order()`.
+    - `num_cols` (int): The number of columns of the table.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture`.
+
+    Returns:
+    - `int`: The number of packets in the file.
+    """
+    import pyshark
+
+    num_of_packets = 0
+    capture = pyshark.FileCapture(input_file=file_path, keep_packets=False, **kwargs)
+    try:
+        for packet_key_name, packet_data in stream_attributes(capture, osi_layers, attributes_to_add):
+            writer.add_row(packet_to_row(packet_data, mapping_attributes_order, num_cols))
+            num_of_packets += 1
+    finally:
+        capture.close()
+    return num_of_packets
+
+
+def rollback_rows(connection: sqlite3.Connection, writer: PacketInfoWriter, last_packet_id: int, table_name: str = 'packet_info') -> int:
+    """
+    Removes the rows of a ring file that failed half way: the rows still buffered in the writer and the rows it already committed, which all have a `Packet_ID` above `last_packet_id`.
+
+    Returns:
+    - `int`: The number of rows that were removed.
+    """
+    with writer.lock:
+        num_of_rows = writer.discard()
+        with connection:
+            num_of_rows += connection.execute(f'DELETE FROM {table_name} WHERE Packet_ID > ?', (last_packet_id,)).rowcount
+    return num_of_rows
+
+
+def continuous_ring_capture(connection: sqlite3.Connection, interface: str, attributes_to_add: list | tuple = list_of_attributes_to_add, columns: dict = attributes, ring_file_name: str = 'ring_spool/capture.pcapng', ring_file_size: int = 10240, num_ring_files: int = 8, max_spool_bytes: int | None = None, max_buffered_rows: int = 1000, poll_interval: float = 1.0, duration: float | None = None, stop_event: threading.Event | None = None, quarantine_directory: str | None = None, capture_kwargs: dict | None = None, **kwargs) -> dict:
+    """
+    Captures continuously with the ring files of a `RingSpool` as a rotating spool. Every ring file is ingested into `packet_info` as soon as the capture program moves on to the next one and is deleted afterwards, so the pipeline can run without growing.
+
+    - Disk: the capture program keeps at most `num_ring_files` files of `ring_file_size` kilobytes. `max_spool_bytes` is a stricter cap on every ring file including the one being written, when the spool is larger the oldest files that have not been ingested yet are deleted and counted as dropped.
+    - Memory: one packet is decoded at a time, with `keep_packets=False`, and at most `max_buffered_rows` rows wait for the next insert.
+    - Overload: when ingestion falls behind, the capture program deletes the oldest ring files on its own. A file that is gone before or while it is ingested is counted as dropped and the capture carries on.
+    - Bad files: a file that fails to ingest (Exp: a truncated or corrupt ring file) has its rows removed again, is moved to `quarantine_directory` and is counted as quarantined, so it is neither half stored nor ingested twice and the capture carries on.
+
+    Ring files left in the spool by an earlier run are ingested first.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `interface` (str): An interface that will be used to capture packets from. Exp: `Ethernet 2`.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns.
+    - `columns` (dict): The columns of the `packet_info` table.
+    - `ring_file_name` (str): The path of the ring files. Its directory is created if it is missing.
+    - `ring_file_size` (int): The size of a ring file in kilobytes.
+    - `num_ring_files` (int): The number of ring files the capture program keeps.
+    - `max_spool_bytes` (int | None): The maximum size of the spool in bytes. `None` only relies on `num_ring_files`.
+    - `max_buffered_rows` (int): The batch size of the writer.
+    - `poll_interval` (float): Seconds between looking for completed ring files.
+    - `duration` (float | None): Seconds to capture for. `None` captures until `stop_event` is set or the capture program stops.
+    - `stop_event` (Event | None): Set it from another thread to stop the capture. The files that are left are still ingested.
+    - `quarantine_directory` (str | None): Where files that fail to ingest are moved. Defaults to `quarantine` next to the ring files.
+    - `capture_kwargs` (dict | None): Additional keyword arguments passed to `RingSpool`. Exp: `{'bpf_filter': 'tcp'}`.
+    - `**kwargs`: Additional keyword arguments passed to `pyshark.FileCapture` when a ring file is read.
+
+    Returns:
+    - `dict`: Exp: `{'captured': 120000, 'packets': 119800, 'files': 24, 'dropped_files': 1, 'dropped_packets': 5000, 'quarantined_files': 0}`. `captured` is counted from the record headers of the ring files, `packets` by the ingestion. `dropped_packets` only counts the files that were dropped by `max_spool_bytes`, a file deleted by the capture program can not be counted anymore.
+    """
+    spool_directory = os.path.dirname(ring_file_name)
+    if spool_directory:
+        os.makedirs(spool_directory, exist_ok=True)
+    create_packet_info_table(connection, columns)
+    quarantine_directory = quarantine_directory or os.path.join(spool_directory, 'quarantine')
+
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    stats = {'captured': 0, 'packets': 0, 'files': 0, 'dropped_files': 0, 'dropped_packets': 0, 'quarantined_files': 0}
+    osi_layers = instantiate_all_osi_layers()
+    mapping_attributes_order = map_attributes_order(attributes_to_add)
+
+    def drop(file_path: str) -> None:
+        try:
+            stats['dropped_packets'] += count_capture_frames(file_path)
+            os.remove(file_path)
+        except (FileNotFoundError, ValueError):
+            pass
+        stats['dropped_files'] += 1
+        increment('ring_spool.dropped_files')
+
+    def quarantine(file_path: str) -> None:
+        os.makedirs(quarantine_directory, exist_ok=True)
+        try:
+            shutil.move(file_path, os.path.join(quarantine_directory, os.path.basename(file_path)))
+        except FileNotFoundError:
+            pass
+        stats['quarantined_files'] += 1
+        increment('ring_spool.quarantined_files')
+
+    def drain(ring_files: list[str], current_file: str | None = None) -> None:
+        if max_spool_bytes is not None:
+            file_sizes = {}
+            for file_path in ring_files + ([current_file] if current_file else []):
+                try:
+                    file_sizes[file_path] = os.path.getsize(file_path)
+                except FileNotFoundError:
+                    file_sizes[file_path] = 0
+            spool_bytes = sum(file_sizes.values())
+            while ring_files and spool_bytes > max_spool_bytes:
+                file_path = ring_files.pop(0)
+                spool_bytes -= file_sizes[file_path]
+                drop(file_path)
+        for file_path in ring_files:
+            last_packet_id = connection.execute('SELECT COALESCE(MAX(Packet_ID), 0) FROM packet_info').fetchone()[0]
+            try:
+                captured = count_capture_frames(file_path)
+                packets = ingest_ring_file(writer, file_path, osi_layers, attributes_to_add, mapping_attributes_order, len(columns), **kwargs)
+                writer.flush()
+            except Exception:
+                rollback_rows(connection, writer, last_packet_id)
+                if os.path.exists(file_path):
+                    quarantine(file_path)
+                else:
+                    # The capture program rotated the file away before it was ingested
+                    drop(file_path)
+                continue
+            stats['captured'] += captured
+            stats['packets'] += packets
+            stats['files'] += 1
+            increment('ring_spool.files')
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    spool = RingSpool(interface, ring_file_name, ring_file_size, num_ring_files, **(capture_kwargs or {}))
+    start_time = time.monotonic()
+    with PacketInfoWriter(connection, columns, batch_size=max_buffered_rows) as writer:
+        spool.start()
+        try:
+            while spool.is_alive() and not stop_event.is_set():
+                if duration is not None and time.monotonic() - start_time >= duration:
+                    break
+                ring_files = list_ring_files(ring_file_name)
+                set_gauge('ring_spool.files', len(ring_files))
+                # The newest file is still being written by the capture program
+                drain(ring_files[:-1], ring_files[-1] if ring_files else None)
+                stop_event.wait(poll_interval)
+        finally:
+            spool.stop()
+        drain(list_ring_files(ring_file_name))
+
+    if spool.error is not None:
+        raise spool.error
+    return stats
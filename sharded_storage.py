@@ -0,0 +1,258 @@
+import math
+import os
+import sqlite3
+import time
+from packet_queries import TIMESTAMP_COLUMN, create_packet_info_indexes, stream_query
+from sqlite_connection import PacketInfoWriter, create_connection_to_db, create_packet_info_table, create_table_for_db, typed_attributes
+
+
+def create_catalog_table(connection: sqlite3.Connection) -> sqlite3.Cursor:
+    """
+    Creates the `shards` table if it is not already present. It lists every shard database with the time range and number of its rows.
+    """
+    return create_table_for_db(connection, """CREATE TABLE IF NOT EXISTS shards (Shard_ID INTEGER PRIMARY KEY, shard_file TEXT UNIQUE, start_time REAL, end_time REAL, row_count INTEGER)""")
+
+
+def remove_database_file(file_path: str) -> None:
+    """
+    Removes a database file together with its WAL and shared memory files.
+    """
+    for path in (file_path, f'{file_path}-wal', f'{file_path}-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class OpenShard:
+    """
+    A shard database that rows are being written to, with the time range and number of its rows.
+    """
+    def __init__(self, shard_file: str, window_start: float | None, start_time: float, end_time: float, row_count: int = 0) -> None:
+        self.shard_file = shard_file
+        self.window_start = window_start
+        self.start_time = start_time
+        self.end_time = end_time
+        self.row_count = row_count
+        self.connection = None
+        self.writer = None
+
+
+class ShardedPacketStore:
+    """
+    Stores packets in a directory of shard databases instead of one ever growing `packet_storage.db`. A new shard is started for every time window and whenever a shard is full, so every shard keeps a small B-tree. `catalog.db` lists the time range of each shard, which lets queries only open the shards they need and lets retention drop whole shard files instead of running `DELETE`s.
+
+    A shard is kept open for each of the last `max_open_shards` windows, so rows from interleaved sources or reordered around a window boundary go to the shard of their window instead of starting a new shard per row. A late row for a window whose shard was closed is appended to that shard again.
+
+    Parameters:
+    - `directory` (str): The directory of the shard databases and the catalog. It is created if it is missing.
+    - `attributes` (dict): The columns of the `packet_info` table of each shard. If there is a `capture_timestamp` column it is used to pick the shard, otherwise the time of insertion is used.
+    - `shard_seconds` (float | None): The length of the time window of a shard. Exp: `3600` for one shard per hour. `None` only rolls over on `max_rows`.
+    - `max_rows` (int | None): The number of rows after which a new shard is started. `None` only rolls over on `shard_seconds`.
+    - `retention_seconds` (float | None): How long shards are kept by `apply_retention()`. `None` keeps every shard.
+    - `max_open_shards` (int): The number of shards that are kept open. The shard of the oldest window is closed when a row for a new window arrives.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`. Exp: `journal_mode='WAL'`.
+
+    Example:
+    - `with ShardedPacketStore('shards/', retention_seconds=86400) as store: store.add_rows(rows)` and then `store.query_time_range(start_time, end_time)`.
+    """
+    def __init__(self, directory: str, attributes: dict = typed_attributes, shard_seconds: float | None = 3600.0, max_rows: int | None = None, retention_seconds: float | None = None, max_open_shards: int = 4, **kwargs) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.attributes = attributes
+        self.shard_seconds = shard_seconds
+        self.max_rows = max_rows
+        self.retention_seconds = retention_seconds
+        self.max_open_shards = max_open_shards
+        self.writer_kwargs = kwargs
+        self.timestamp_index = list(attributes).index(TIMESTAMP_COLUMN) if TIMESTAMP_COLUMN in attributes else None
+
+        self.catalog = create_connection_to_db(os.path.join(directory, 'catalog.db'))
+        create_catalog_table(self.catalog)
+
+        # The open shard of each window, by the start of the window
+        self.open_shards = {}
+
+
+    def __enter__(self) -> 'ShardedPacketStore':
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def window_of(self, timestamp: float) -> float | None:
+        if self.shard_seconds is None:
+            return None
+        return math.floor(timestamp / self.shard_seconds) * self.shard_seconds
+
+
+    def update_catalog(self, shard: OpenShard) -> None:
+        """
+        Stores the time range and row count of a shard in the catalog. Used as the `on_flush` of the shard writer, so the catalog is updated every time rows are committed.
+        """
+        with self.catalog:
+            self.catalog.execute('UPDATE shards SET start_time = ?, end_time = ?, row_count = ? WHERE shard_file = ?', (shard.start_time, shard.end_time, shard.row_count, shard.shard_file))
+
+
+    def find_shard(self, window_start: float | None) -> OpenShard | None:
+        """
+        Returns the newest shard of a window from the catalog if it still has room, so late rows are appended to it instead of starting another shard.
+        """
+        query = 'SELECT shard_file, start_time, end_time, row_count FROM shards'
+        parameters = ()
+        if window_start is not None:
+            query += ' WHERE start_time >= ? AND start_time < ?'
+            parameters = (window_start, window_start + self.shard_seconds)
+        row = self.catalog.execute(query + ' ORDER BY Shard_ID DESC LIMIT 1', parameters).fetchone()
+        if row is None or (self.max_rows is not None and row[3] >= self.max_rows):
+            return None
+        return OpenShard(row[0], window_start, row[1], row[2], row[3])
+
+
+    def create_shard(self, window_start: float | None, timestamp: float) -> OpenShard:
+        with self.catalog:
+            cursor = self.catalog.execute('INSERT INTO shards (shard_file, start_time, end_time, row_count) VALUES (NULL, ?, ?, 0)', (timestamp, timestamp))
+            shard_id = cursor.lastrowid
+            shard_file = f'shard_{time.strftime("%Y%m%d_%H%M%S", time.gmtime(timestamp))}_{shard_id}.db'
+            self.catalog.execute('UPDATE shards SET shard_file = ? WHERE Shard_ID = ?', (shard_file, shard_id))
+        return OpenShard(shard_file, window_start, timestamp, timestamp)
+
+
+    def open_shard(self, timestamp: float, reuse: bool = True) -> OpenShard:
+        """
+        Opens the shard for the window of a timestamp, closing the shard of the oldest window if `max_open_shards` are already open.
+
+        Parameters:
+        - `timestamp` (float): The timestamp of the row that needs the shard.
+        - `reuse` (bool): Appends to the newest shard of the window if it still has room. `False` always starts a new shard (Exp: when the shard is full).
+        """
+        window_start = self.window_of(timestamp)
+        if len(self.open_shards) >= self.max_open_shards:
+            self.close_shard(min(self.open_shards, key=lambda window: self.open_shards[window].start_time))
+        shard = (self.find_shard(window_start) if reuse else None) or self.create_shard(window_start, timestamp)
+
+        shard.connection = create_connection_to_db(os.path.join(self.directory, shard.shard_file))
+        create_packet_info_table(shard.connection, self.attributes)
+        create_packet_info_indexes(shard.connection)
+        # The catalog is shared by every shard, so shard writers only flush from the thread that adds the rows
+        shard.writer = PacketInfoWriter(shard.connection, self.attributes, on_flush=lambda connection: self.update_catalog(shard), idle_flush=False, **self.writer_kwargs)
+        self.open_shards[window_start] = shard
+        return shard
+
+
+    def close_shard(self, window_start: float | None) -> None:
+        shard = self.open_shards.pop(window_start, None)
+        if shard is None:
+            return
+        shard.writer.close()
+        self.update_catalog(shard)
+        shard.connection.close()
+
+
+    def add_row(self, row: list | tuple) -> None:
+        """
+        Buffers a row in the shard of its time window, first rolling over to a new shard if that shard is full.
+        """
+        timestamp = row[self.timestamp_index] if self.timestamp_index is not None else None
+        if type(timestamp) not in (int, float):
+            timestamp = time.time()
+
+        window_start = self.window_of(timestamp)
+        shard = self.open_shards.get(window_start)
+        if shard is not None and self.max_rows is not None and shard.row_count >= self.max_rows:
+            self.close_shard(window_start)
+            shard = self.open_shard(timestamp, reuse=False)
+        elif shard is None:
+            shard = self.open_shard(timestamp)
+
+        shard.start_time = min(shard.start_time, timestamp)
+        shard.end_time = max(shard.end_time, timestamp)
+        shard.row_count += 1
+        shard.writer.add_row(row)
+
+
+    def add_rows(self, rows) -> None:
+        for row in rows:
+            self.add_row(row)
+
+
+    def flush(self) -> None:
+        for shard in self.open_shards.values():
+            shard.writer.flush()
+
+
+    def close(self) -> None:
+        for window_start in list(self.open_shards):
+            self.close_shard(window_start)
+        self.catalog.close()
+
+
+    def shards_for_range(self, start_time: float | None = None, end_time: float | None = None) -> list[str]:
+        """
+        Returns the shard files that may hold rows captured from `start_time` up to, but not including, `end_time`, in time order. `None` leaves that side of the range open. Rows still buffered in the writer are flushed first, so they are in the catalog.
+        """
+        self.flush()
+        query = 'SELECT shard_file FROM shards WHERE row_count > 0'
+        parameters = ()
+        if start_time is not None:
+            query += ' AND end_time >= ?'
+            parameters += (start_time,)
+        if end_time is not None:
+            query += ' AND start_time < ?'
+            parameters += (end_time,)
+        return [row[0] for row in self.catalog.execute(query + ' ORDER BY start_time, Shard_ID', parameters)]
+
+
+    def stream_query(self, where: str | list, parameters: tuple = (), start_time: float | None = None, end_time: float | None = None, **kwargs):
+        """
+        Runs a query over the shards that overlap a time range, one shard at a time.
+
+        Parameters:
+        - `where` (str | list): The `WHERE` clause with `?` placeholders, or a list of `(where, parameters)` branches. Exp: `'src_port = ?'`.
+        - `parameters` (tuple): The values of the placeholders.
+        - `start_time` (float | None): Only opens shards with rows from this time on.
+        - `end_time` (float | None): Only opens shards with rows before this time.
+        - `**kwargs`: Additional keyword arguments passed to `packet_queries.stream_query()`. `Packet_ID`s are only unique within a shard, so `after_id` and `page_size` apply to each shard.
+
+        Returns:
+        - A generator that yields `(shard_file, row)` tuples.
+        """
+        for shard_file in self.shards_for_range(start_time, end_time):
+            connection = create_connection_to_db(os.path.join(self.directory, shard_file))
+            try:
+                for row in stream_query(connection, where, parameters, **kwargs):
+                    yield shard_file, row
+            finally:
+                connection.close()
+
+
+    def query_time_range(self, start_time: float, end_time: float, **kwargs):
+        """
+        Streams the packets captured from `start_time` up to, but not including, `end_time` from the shards that overlap the range. Needs a `capture_timestamp` column.
+        """
+        if self.timestamp_index is None:
+            raise ValueError(f'The shards have no {TIMESTAMP_COLUMN} column to query by time range')
+        kwargs.setdefault('order_column', TIMESTAMP_COLUMN)
+        return self.stream_query(f'{TIMESTAMP_COLUMN} >= ? AND {TIMESTAMP_COLUMN} < ?', (start_time, end_time), start_time, end_time, **kwargs)
+
+
+    def apply_retention(self, now: float | None = None) -> list[str]:
+        """
+        Removes every shard whose newest row is older than the retention. Shards that are open for writing are never removed.
+
+        Parameters:
+        - `now` (float | None): The current time. Defaults to `time.time()`.
+
+        Returns:
+        - `list`: The shard files that were removed.
+        """
+        if self.retention_seconds is None:
+            return []
+        now = time.time() if now is None else now
+        open_shard_files = {shard.shard_file for shard in self.open_shards.values()}
+        expired_shards = [row[0] for row in self.catalog.execute('SELECT shard_file FROM shards WHERE end_time < ? ORDER BY start_time', (now - self.retention_seconds,)) if row[0] not in open_shard_files]
+        for shard_file in expired_shards:
+            with self.catalog:
+                self.catalog.execute('DELETE FROM shards WHERE shard_file = ?', (shard_file,))
+            remove_database_file(os.path.join(self.directory, shard_file))
+        return expired_shards
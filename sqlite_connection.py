@@ -1,6 +1,10 @@
+import argparse
 import sqlite3
-from capture_traffic import combine_dict
-from capture_traffic import list_of_attributes_to_add
+import threading
+import time
+from capture_traffic import capture_packet_records, list_of_attributes_to_add
+from packet_records import PacketRecords, mac_to_int, pack_ip
+from pipeline_metrics import timed, increment, set_gauge
 from pprint import pprint
 
 
@@ -12,9 +16,9 @@ def create_connection_to_db(schema: str) -> sqlite3.Connection:
     - `schema`: (str): The name of the database schema to be created if it is not already present.
 
     Returns:
-    - `Connection`: Will return a connection that can be used to create/modify tables.
+    - `Connection`: Will return a connection that can be used to create/modify tables. It can be used from other threads, so a `PacketInfoWriter` can flush from its idle flush thread.
     """
-    return sqlite3.connect(schema)
+    return sqlite3.connect(schema, check_same_thread=False)
 
 
 def create_table_for_db(connection: sqlite3.Connection, sql_query: str) -> None:
@@ -38,9 +42,213 @@ def parameterized_query(num_of_inputs: int | list |dict | tuple) -> str:
         return ','.join(['?' for _ in range(len(num_of_inputs))])
 
 
-# Create a db scheme connection, specify attributes to use for the packet_info table, and create the table
-connection = create_connection_to_db('packet_storage.db')
+def map_attributes_order(attributes_to_add: list | tuple) -> dict:
+    """
+    Maps each attribute to its column index to guarantee correct placing before it is sent to the database.
+
+    Parameters:
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns. Exp: `['datalink_layer.src', 'datalink_layer.dst']`.
+
+    Returns:
+    - `dict`: The attribute as the `key` and its column index as the `value`.
+    """
+    return {element: index for index, element in enumerate(attributes_to_add)}
+
+
+def packet_to_row(packet_data: dict, mapping_attributes_order: dict, num_of_columns: int) -> list:
+    """
+    Finds the attribute values of a single packet and stores them into a list in column order.
+
+    Parameters:
+    - `packet_data` (dict): The layers of one packet. Exp: `combine_dict['Packet 1']`.
+    - `mapping_attributes_order` (dict): The dict returned from the `map_attributes_order()`.
+    - `num_of_columns` (int): The number of columns in the table.
+
+    Returns:
+    - `list`: The values to insert. Attributes that are missing from the packet are `None`.
+    """
+    values_to_add_list = list([None] * num_of_columns)
+    for keys, values in packet_data.items():
+        for inner_key, inner_value in values.items():
+            if inner_key in mapping_attributes_order:
+                values_to_add_list[mapping_attributes_order[inner_key]] = inner_value
+    return values_to_add_list
+
+
+class PacketInfoWriter:
+    """
+    Buffers rows for a table and inserts them with `executemany` inside a single transaction, instead of one `execute` and one `commit` per packet.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `attributes` (dict | list): The columns of the table. Used to build the INSERT query once.
+    - `table_name` (str): The table to insert into. Default `'packet_info'`.
+    - `batch_size` (int): The number of buffered rows that triggers a flush.
+    - `flush_interval` (float | None): The number of seconds after which buffered rows are flushed even if the batch is not full. It is checked when a row is added and by an idle flush thread, so rows are committed while a quiet interface keeps the consumer waiting for the next packet. `None` only flushes on the batch size.
+    - `idle_flush` (bool): Starts the idle flush thread. It needs a connection that can be used from another thread, like the ones from `create_connection_to_db()`, otherwise rows are only flushed when a row is added. Hold `lock` around changes that have to be committed together with the buffered rows.
+    - `journal_mode` (str | None): Optional `journal_mode` pragma. Exp: `'WAL'`.
+    - `synchronous` (str | None): Optional `synchronous` pragma. Exp: `'NORMAL'`.
+    - `on_flush` (callable | None): Called with the connection inside the flush transaction, so other writes (Exp: an ingestion checkpoint) are committed together with the rows.
+
+    Example:
+    - `with PacketInfoWriter(connection, attributes, journal_mode='WAL') as writer: writer.add_row(row)`
+    """
+    def __init__(self, connection: sqlite3.Connection, attributes: dict | list, table_name: str = 'packet_info', batch_size: int = 1000, flush_interval: float | None = 1.0, journal_mode: str | None = None, synchronous: str | None = None, on_flush=None, idle_flush: bool = True) -> None:
+        self.connection = connection
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        columns = list(attributes.keys()) if type(attributes) == dict else list(attributes)
+        self.insert_query = f"""INSERT INTO {table_name} ({format_attribute_columns_for_table(columns)}) VALUES ({parameterized_query(columns)})"""
+        if journal_mode is not None:
+            self.connection.execute(f'PRAGMA journal_mode={journal_mode}')
+        if synchronous is not None:
+            self.connection.execute(f'PRAGMA synchronous={synchronous}')
+        self.rows = []
+        self.rows_written = 0
+        self.start_time = time.perf_counter()
+        self.last_flush = self.start_time
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        self.idle_flush_thread = None
+        if idle_flush and flush_interval is not None:
+            self.idle_flush_thread = threading.Thread(target=self.run_idle_flush, name='packet-info-idle-flush', daemon=True)
+            self.idle_flush_thread.start()
+
+
+    def __enter__(self) -> 'PacketInfoWriter':
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def run_idle_flush(self) -> None:
+        """
+        Body of the idle flush thread. Flushes rows that have waited `flush_interval` seconds until the writer is closed. It stops if the connection can not be used from this thread, the rows are then flushed by `add_row()` and `close()` as before.
+        """
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush_if_due()
+            except sqlite3.ProgrammingError:
+                increment('sqlite.idle_flush_errors')
+                return
+
+
+    def add_row(self, row: list | tuple) -> None:
+        """
+        Buffers a row and flushes the buffer if the batch size or the flush interval has been reached.
+        """
+        with self.lock:
+            self.rows.append(row)
+            set_gauge('sqlite.buffered_rows', len(self.rows))
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+            else:
+                self.flush_if_due()
+
+
+    def flush_if_due(self) -> int:
+        """
+        Flushes the buffered rows if `flush_interval` has passed since the last flush. The idle flush thread calls it, so it only has to be called by hand when `idle_flush` is off.
+
+        Returns:
+        - `int`: The number of rows that were inserted.
+        """
+        with self.lock:
+            if self.rows and self.flush_interval is not None and time.perf_counter() - self.last_flush >= self.flush_interval:
+                return self.flush()
+        return 0
+
+
+    def add_rows(self, rows) -> None:
+        """
+        Buffers every row from an iterable of rows. Exp: `packet_records.PacketRecords.rows()`.
+        """
+        for row in rows:
+            self.add_row(row)
+
+
+    def flush(self) -> int:
+        """
+        Inserts every buffered row inside a single transaction.
+
+        Returns:
+        - `int`: The number of rows that were inserted.
+        """
+        with self.lock:
+            num_of_rows = len(self.rows)
+            if num_of_rows:
+                with timed('sqlite.flush_seconds'), self.connection:
+                    self.connection.executemany(self.insert_query, self.rows)
+                    if self.on_flush is not None:
+                        self.on_flush(self.connection)
+                increment('sqlite.rows', num_of_rows)
+                self.rows_written += num_of_rows
+                self.rows = []
+                set_gauge('sqlite.buffered_rows', 0)
+            self.last_flush = time.perf_counter()
+        return num_of_rows
+
+
+    def discard(self) -> int:
+        """
+        Drops the buffered rows without inserting them. Exp: the rows of a capture file that failed half way.
+
+        Returns:
+        - `int`: The number of rows that were dropped.
+        """
+        with self.lock:
+            num_of_rows = len(self.rows)
+            self.rows = []
+            set_gauge('sqlite.buffered_rows', 0)
+        return num_of_rows
+
+
+    def close(self) -> int:
+        """
+        Stops the idle flush thread and flushes the rows that are left.
+
+        Returns:
+        - `int`: The number of rows that were inserted.
+        """
+        self.closed.set()
+        if self.idle_flush_thread is not None and self.idle_flush_thread is not threading.current_thread():
+            self.idle_flush_thread.join()
+        return self.flush()
+
+
+    def rows_per_second(self) -> float:
+        """
+        Returns the number of rows written per second since the writer was created.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+
+def insert_packet_stream(connection: sqlite3.Connection, packet_stream, attributes: dict, attributes_to_add: list | tuple, **kwargs) -> int:
+    """
+    Inserts packets into the `packet_info` table as they are handed over from a packet stream.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `packet_stream`: An iterable of `('Packet N', packet_data)` tuples. Exp: `capture_traffic_functions.stream_attributes()`.
+    - `attributes` (dict): The columns of the `packet_info` table.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`. Exp: `batch_size=500`.
+
+    Returns:
+    - `int`: The number of packets that were inserted.
+    """
+    mapping_attributes_order = map_attributes_order(attributes_to_add)
+    with PacketInfoWriter(connection, attributes, **kwargs) as writer:
+        for packet_key_name, packet_data in packet_stream:
+            writer.add_row(packet_to_row(packet_data, mapping_attributes_order, len(attributes)))
+    return writer.rows_written
 
+
+# Attributes to use for the packet_info table
 attributes = {'src_mac': 'TEXT', 
               'dest_mac': 'TEXT', 
               'src_ip': 'TEXT', 
@@ -49,32 +257,173 @@ attributes = {'src_mac': 'TEXT',
               'dest_port': 'INT'
               }
 
-attributes_to_create_table = format_attribute_columns_for_table(attributes)
 
-create_packet_info_table = create_table_for_db(connection, f"""CREATE TABLE IF NOT EXISTS packet_info (Packet_ID INTEGER PRIMARY KEY, {attributes_to_create_table})""")
+# Typed schema mode. MACs are stored as 48-bit integers and IPs as 16 byte blobs instead of text, packed by the same helpers as `packet_records` (IPv4 as IPv4-mapped IPv6), which keeps the database small and lets address blocks be range scanned. The capture timestamp, frame length and IP protocol number are stored as well.
+typed_attributes = {'src_mac': 'INTEGER',
+                    'dest_mac': 'INTEGER',
+                    'src_ip': 'BLOB',
+                    'dest_ip': 'BLOB',
+                    'src_port': 'INTEGER',
+                    'dest_port': 'INTEGER',
+                    'capture_timestamp': 'REAL',
+                    'frame_length': 'INTEGER',
+                    'protocol_id': 'INTEGER'
+                    }
 
-attributes_to_insert_into_table = format_attribute_columns_for_table(list(attributes.keys()))
+# Attributes for the typed schema in the same order as its columns. IPv6 stores the protocol number in `nxt` instead of `proto`.
+typed_attributes_to_add = list_of_attributes_to_add + ['frame.timestamp', 'frame.length', 'network_layer.proto']
 
-# Mapping attributes to index values to guarantee correct placing before sent to SQL DB
-mapping_attributes_order = dict()
-for index, element in enumerate(list_of_attributes_to_add):
-    mapping_attributes_order[element] = index
+SCHEMA_MODES = {'text': attributes, 'typed': typed_attributes}
 
-# Finding attributes values and then store them into a list to be sent to DB
-for index, value in enumerate(combine_dict.values(), start=1):
-    values_to_add_list = list([None] * len(attributes))
-    for keys, values in value.items():
-        for inner_key, inner_value in values.items():
-            if inner_key in mapping_attributes_order:
-                values_to_add_list[mapping_attributes_order[inner_key]] = inner_value
 
-    print(values_to_add_list)
-    create_packet_info_table.execute(f"""INSERT INTO packet_info ({attributes_to_insert_into_table}) VALUES ({parameterized_query(attributes)})""", (values_to_add_list))
+# How each column of the typed schema is converted from the text value pyshark returns. `packet_records.int_to_mac()` and `packet_records.unpack_ip()` turn them back into text.
+TYPED_CONVERTERS = {'src_mac': mac_to_int,
+                    'dest_mac': mac_to_int,
+                    'src_ip': pack_ip,
+                    'dest_ip': pack_ip,
+                    'src_port': int,
+                    'dest_port': int,
+                    'capture_timestamp': float,
+                    'frame_length': int,
+                    'protocol_id': lambda value: int(value, 0)
+                    }
+
+
+def build_table_schema(attributes: dict | str = 'text', table_name: str = 'packet_info') -> str:
+    """
+    Builds the `CREATE TABLE` query of a packet table. Generalises `format_attribute_columns_for_table()` to the schema modes.
+
+    Parameters:
+    - `attributes` (dict | str): The columns of the table, or the name of one of the `SCHEMA_MODES`. Exp: `'typed'`.
+    - `table_name` (str): The name of the table.
+
+    Returns:
+    - `str`: The query that creates the table if it is not already present.
+    """
+    if type(attributes) == str:
+        attributes = SCHEMA_MODES[attributes]
+    return f"""CREATE TABLE IF NOT EXISTS {table_name} (Packet_ID INTEGER PRIMARY KEY, {format_attribute_columns_for_table(attributes)})"""
+
+
+def convert_typed_row(values_to_add_list: list, columns: dict = typed_attributes) -> tuple:
+    """
+    Converts a row of text values into the types of the typed schema. Values that can not be converted are stored as they are.
+
+    Parameters:
+    - `values_to_add_list` (list): The values in column order. Exp: from the `packet_to_row()`.
+    - `columns` (dict | list): The columns of the table. Only columns with an entry in `TYPED_CONVERTERS` are converted, a `None` in a list leaves its column as it is.
+    """
+    converted_row = []
+    for column, value in zip(columns, values_to_add_list):
+        converter = TYPED_CONVERTERS.get(column)
+        if value is not None and converter is not None:
+            try:
+                value = converter(value)
+            except (TypeError, ValueError):
+                pass
+        converted_row.append(value)
+    return tuple(converted_row)
+
+
+def create_packet_info_table(connection: sqlite3.Connection, attributes: dict | str = attributes) -> sqlite3.Cursor:
+    """
+    Creates the `packet_info` table if it is not already present.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `attributes` (dict | str): The column names as the `key` and their SQL types as the `value`, or the name of one of the `SCHEMA_MODES`.
+
+    Returns:
+    - `Cursor`: The cursor that created the table.
+    """
+    cursor = create_table_for_db(connection, build_table_schema(attributes))
+    add_missing_columns(connection, attributes)
+    return cursor
+
+
+def add_missing_columns(connection: sqlite3.Connection, attributes: dict | str = attributes, table_name: str = 'packet_info') -> list[str]:
+    """
+    Adds the columns of `attributes` that an existing table does not have yet, since `CREATE TABLE IF NOT EXISTS` leaves an existing table as it is. Exp: the `interface` column of `multi_capture` on a `packet_info` table made by `capture_traffic`. Rows that were already stored get `NULL` in the new columns.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `attributes` (dict | str): The column names as the `key` and their SQL types as the `value`, or the name of one of the `SCHEMA_MODES`.
+    - `table_name` (str): The name of the table.
+
+    Returns:
+    - `list`: The columns that were added.
+    """
+    if type(attributes) == str:
+        attributes = SCHEMA_MODES[attributes]
+    existing_columns = {row[1] for row in connection.execute(f'PRAGMA table_info({table_name})')}
+    missing_columns = [column for column in attributes if column not in existing_columns]
+    with connection:
+        for column in missing_columns:
+            connection.execute(f'ALTER TABLE {table_name} ADD COLUMN {column} {attributes[column]}')
+    return missing_columns
+
+
+def insert_typed_packet_stream(connection: sqlite3.Connection, packet_stream, **kwargs) -> int:
+    """
+    Inserts packets into a `packet_info` table that uses the typed schema. Each value is converted once, when its row is built.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `packet_stream`: An iterable of `('Packet N', packet_data)` tuples, from `capture_traffic_functions.stream_attributes()` with `typed_attributes_to_add + ['network_layer.nxt']`.
+    - `**kwargs`: Additional keyword arguments passed to `PacketInfoWriter`.
+
+    Returns:
+    - `int`: The number of packets that were inserted.
+    """
+    mapping_attributes_order = map_attributes_order(typed_attributes_to_add)
+    mapping_attributes_order['network_layer.nxt'] = mapping_attributes_order['network_layer.proto']
+    with PacketInfoWriter(connection, typed_attributes, **kwargs) as writer:
+        for packet_key_name, packet_data in packet_stream:
+            writer.add_row(convert_typed_row(packet_to_row(packet_data, mapping_attributes_order, len(typed_attributes))))
+    return writer.rows_written
+
+
+def store_packets(connection: sqlite3.Connection, packet_records: PacketRecords | dict, attributes_to_add: list | tuple, attributes: dict = attributes) -> int:
+    """
+    Stores the packets from the capture pipeline into the `packet_info` table.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `packet_records` (PacketRecords | dict): The `PacketRecords` returned from `capture_traffic.capture_packet_records()`. The dict returned from `capture_traffic.capture_packets()` is also accepted and packed first.
+    - `attributes_to_add` (list | tuple): The attributes in the same order as the table columns.
+    - `attributes` (dict): The columns of the `packet_info` table.
+
+    Returns:
+    - `int`: The number of packets that were stored.
+    """
+    if not isinstance(packet_records, PacketRecords):
+        packet_records = PacketRecords.from_attribute_dict(packet_records, attributes_to_add)
+    # Send the attributes to the DB in batches, in the same order as the table columns
+    with PacketInfoWriter(connection, attributes) as writer:
+        writer.add_rows(packet_records.rows(attributes_to_add))
+    return writer.rows_written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Capture live traffic and store it in the packet_info table.')
+    parser.add_argument('--interface', default='Ethernet 2', help='The interface to capture packets from.')
+    parser.add_argument('--num-packets', type=int, default=2, help='The number of packets to capture.')
+    parser.add_argument('--encryption-type', default='wpa-pwk', help='Passed to pyshark.LiveCapture.')
+    parser.add_argument('--db', default='packet_storage.db', help='The database file to store the packets in.')
+    args = parser.parse_args()
+
+    packet_records = capture_packet_records(interface=args.interface, num_packets=args.num_packets, encryption_type=args.encryption_type)
+
+    connection = create_connection_to_db(args.db)
+    create_packet_info_table(connection)
+    store_packets(connection, packet_records, list_of_attributes_to_add)
+
+    rows = connection.execute('SELECT * FROM packet_info').fetchall()
+    for packet_info in rows:
+        print(packet_info)
 
-    connection.commit()
+    connection.close()
 
-rows = create_packet_info_table.execute('SELECT * FROM packet_info').fetchall()
-for packet_info in rows:
-    print(packet_info)
 
-connection.close()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
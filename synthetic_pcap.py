@@ -0,0 +1,118 @@
+import ipaddress
+import random
+import struct
+
+
+# Ethernet link type and EtherTypes used in the pcap files
+LINKTYPE_ETHERNET = 1
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+
+# The kinds of packets that are generated, picked in turn so every kind shows up in every file
+PACKET_KINDS = ('ipv4_tcp', 'ipv4_udp', 'ipv6_tcp', 'ipv6_udp', 'ipv4_dns', 'ipv4_http')
+
+
+def internet_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def build_ethernet(src_mac: bytes, dst_mac: bytes, ether_type: int, payload: bytes) -> bytes:
+    return dst_mac + src_mac + struct.pack('!H', ether_type) + payload
+
+
+def build_ipv4(src_ip: str, dst_ip: str, protocol: int, payload: bytes, identification: int = 0) -> bytes:
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), identification, 0x4000, 64, protocol, 0, ipaddress.IPv4Address(src_ip).packed, ipaddress.IPv4Address(dst_ip).packed)
+    return header[:10] + struct.pack('!H', internet_checksum(header)) + header[12:] + payload
+
+
+def build_ipv6(src_ip: str, dst_ip: str, next_header: int, payload: bytes) -> bytes:
+    return struct.pack('!IHBB16s16s', 6 << 28, len(payload), next_header, 64, ipaddress.IPv6Address(src_ip).packed, ipaddress.IPv6Address(dst_ip).packed) + payload
+
+
+def build_tcp(src_port: int, dst_port: int, payload: bytes, seq: int = 0, flags: int = 0x18) -> bytes:
+    return struct.pack('!HHIIBBHHH', src_port, dst_port, seq, 0, 5 << 4, flags, 65535, 0, 0) + payload
+
+
+def build_udp(src_port: int, dst_port: int, payload: bytes) -> bytes:
+    return struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0) + payload
+
+
+def build_dns_query(query_id: int, name: str) -> bytes:
+    labels = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\x00'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + labels + struct.pack('!HH', 1, 1)
+
+
+def build_http_request(host: str, path: str) -> bytes:
+    return f'GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: synthetic\r\n\r\n'.encode()
+
+
+def generate_frames(num_packets: int, seed: int = 0):
+    """
+    Generates deterministic Ethernet frames that mix IPv4, IPv6, TCP, UDP, DNS and HTTP traffic.
+
+    Parameters:
+    - `num_packets` (int): The number of frames to generate.
+    - `seed` (int): The seed of the generator. The same seed always gives the same frames.
+
+    Returns:
+    - A generator that yields `(timestamp, frame)` tuples.
+    """
+    generator = random.Random(seed)
+    hosts = [(bytes([0x02, 0, 0, 0, 0, host]), f'10.0.{host // 256}.{host % 256}', f'fd00::{host:x}') for host in range(1, 65)]
+    timestamp = 1700000000.0
+    for index in range(num_packets):
+        kind = PACKET_KINDS[index % len(PACKET_KINDS)]
+        (src_mac, src_ipv4, src_ipv6), (dst_mac, dst_ipv4, dst_ipv6) = generator.sample(hosts, 2)
+        src_port = generator.randint(1024, 65535)
+        payload = bytes(generator.getrandbits(8) for _ in range(generator.randint(0, 64)))
+
+        if kind == 'ipv4_dns':
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV4, build_ipv4(src_ipv4, dst_ipv4, 17, build_udp(src_port, 53, build_dns_query(index & 0xFFFF, f'host{index % 97}.example.com')), index & 0xFFFF))
+        elif kind == 'ipv4_http':
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV4, build_ipv4(src_ipv4, dst_ipv4, 6, build_tcp(src_port, 80, build_http_request('example.com', f'/page/{index % 13}'), index), index & 0xFFFF))
+        elif kind == 'ipv4_tcp':
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV4, build_ipv4(src_ipv4, dst_ipv4, 6, build_tcp(src_port, 443, payload, index), index & 0xFFFF))
+        elif kind == 'ipv4_udp':
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV4, build_ipv4(src_ipv4, dst_ipv4, 17, build_udp(src_port, 5000, payload), index & 0xFFFF))
+        elif kind == 'ipv6_tcp':
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV6, build_ipv6(src_ipv6, dst_ipv6, 6, build_tcp(src_port, 443, payload, index)))
+        else:
+            frame = build_ethernet(src_mac, dst_mac, ETHERTYPE_IPV6, build_ipv6(src_ipv6, dst_ipv6, 17, build_udp(src_port, 5000, payload)))
+
+        timestamp += generator.random() / 100
+        yield timestamp, frame
+
+
+def write_pcap(file_path: str, frames, link_type: int = LINKTYPE_ETHERNET, snap_length: int = 65535) -> int:
+    """
+    Writes frames to a classic (libpcap) capture file with microsecond timestamps.
+
+    Parameters:
+    - `file_path` (str): The file to write.
+    - `frames`: An iterable of `(timestamp, frame)` tuples. Exp: `generate_frames(1000)`.
+
+    Returns:
+    - `int`: The number of frames that were written.
+    """
+    num_of_frames = 0
+    with open(file_path, 'wb') as pcap_file:
+        pcap_file.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, snap_length, link_type))
+        for timestamp, frame in frames:
+            seconds = int(timestamp)
+            microseconds = int((timestamp - seconds) * 1_000_000)
+            pcap_file.write(struct.pack('<IIII', seconds, microseconds, min(len(frame), snap_length), len(frame)))
+            pcap_file.write(frame[:snap_length])
+            num_of_frames += 1
+    return num_of_frames
+
+
+def write_synthetic_pcap(file_path: str, num_packets: int, seed: int = 0) -> int:
+    """
+    Writes a deterministic synthetic pcap file with mixed eth/ip/ipv6/tcp/udp/dns/http traffic.
+    """
+    return write_pcap(file_path, generate_frames(num_packets, seed))
@@ -0,0 +1,201 @@
+import argparse
+import sqlite3
+from packet_queries import TIMESTAMP_COLUMN, get_table_columns
+from sqlite_connection import create_connection_to_db
+
+
+def get_blob_columns(connection: sqlite3.Connection, table_name: str = 'packet_info') -> set[str]:
+    return {row[1] for row in connection.execute(f'PRAGMA table_info({table_name})') if (row[2] or '').upper() == 'BLOB'}
+
+
+def iter_column_chunks(connection: sqlite3.Connection, columns: list[str], table_name: str = 'packet_info', chunk_size: int = 1000000, where: str | None = None, parameters: tuple = ()):
+    """
+    Reads columns of a table into NumPy arrays `chunk_size` rows at a time, so tables larger than memory can be summarised. Rows with a `NULL` in one of the columns are skipped. `BLOB` columns (Exp: the packed IPs of the typed schema) are read as hex strings, which NumPy sorts far faster than bytes objects.
+
+    Parameters:
+    - `connection` (Connection): The connection returned from the `create_connection_to_db()`.
+    - `columns` (list): The columns to read. Exp: `['src_ip', 'dest_ip']`.
+    - `table_name` (str): The table to read.
+    - `chunk_size` (int): The number of rows in a chunk.
+    - `where` (str | None): An extra `WHERE` clause with `?` placeholders. Exp: `'dest_port = ?'`.
+    - `parameters` (tuple): The values of the placeholders.
+
+    Returns:
+    - A generator that yields a list with one array per column for every chunk.
+    """
+    import numpy
+
+    blob_columns = get_blob_columns(connection, table_name)
+    conditions = [f'{column} IS NOT NULL' for column in columns]
+    if where:
+        conditions.append(f'({where})')
+    select_columns = [f'hex({column})' if column in blob_columns else column for column in columns]
+    cursor = connection.execute(f'SELECT {", ".join(select_columns)} FROM {table_name} WHERE {" AND ".join(conditions)}', parameters)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [numpy.asarray(values) for values in zip(*rows)]
+    finally:
+        cursor.close()
+
+
+def merge_counts(totals: dict, keys, counts) -> dict:
+    """
+    Adds the counts of a chunk to the running totals. Only loops over the distinct keys of the chunk, not its rows.
+    """
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        totals[key] = totals.get(key, 0) + count
+    return totals
+
+
+def top_counts(totals: dict, n: int) -> list[tuple]:
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+def unhex_key(key: str, is_blob: bool):
+    """
+    Turns a key of a `BLOB` column back into bytes, since `iter_column_chunks()` reads them as hex strings.
+    """
+    return bytes.fromhex(key) if is_blob else key
+
+
+def top_talkers(connection: sqlite3.Connection, n: int = 10, column: str = 'src_ip', weight_column: str | None = None, **kwargs) -> list[tuple]:
+    """
+    Finds the addresses that sent the most packets, or the most bytes with `weight_column='frame_length'`.
+
+    Parameters:
+    - `n` (int): The number of talkers to return.
+    - `column` (str): The address column. Exp: `'src_mac'`.
+    - `weight_column` (str | None): A column to sum instead of counting packets.
+    - `**kwargs`: Additional keyword arguments passed to `iter_column_chunks()`.
+
+    Returns:
+    - `list`: `(address, total)` tuples, largest first. Exp: `[('10.0.0.5', 51200), ('10.0.0.9', 20480)]`.
+    """
+    import numpy
+
+    totals = {}
+    columns = [column] if weight_column is None else [column, weight_column]
+    for chunk in iter_column_chunks(connection, columns, **kwargs):
+        addresses, inverse = numpy.unique(chunk[0], return_inverse=True)
+        counts = numpy.bincount(inverse, weights=chunk[1] if weight_column is not None else None, minlength=len(addresses))
+        merge_counts(totals, addresses, counts)
+    is_blob = column in get_blob_columns(connection, kwargs.get('table_name', 'packet_info'))
+    return [(unhex_key(address, is_blob), total) for address, total in top_counts(totals, n)]
+
+
+def port_histogram(connection: sqlite3.Connection, column: str = 'dest_port', **kwargs):
+    """
+    Counts the packets of every port number.
+
+    Parameters:
+    - `column` (str): The port column. Exp: `'src_port'`.
+    - `**kwargs`: Additional keyword arguments passed to `iter_column_chunks()`.
+
+    Returns:
+    - `numpy.ndarray`: 65536 counts where index `p` is the number of packets on port `p`. Exp: `histogram.argsort()[::-1][:10]` are the 10 busiest ports. Rows whose port is not a number (Exp: text a dissector left in a `TEXT` column) are skipped.
+    """
+    import numpy
+
+    # Only whole numbers of up to five digits can be ports, anything else is skipped by SQLite instead of failing the conversion
+    port_condition = f"typeof({column}) = 'integer' OR ({column} != '' AND length({column}) <= 5 AND NOT {column} GLOB '*[^0-9]*')"
+    kwargs['where'] = f'({kwargs["where"]}) AND ({port_condition})' if kwargs.get('where') else port_condition
+    histogram = numpy.zeros(65536, dtype=numpy.int64)
+    for chunk in iter_column_chunks(connection, [column], **kwargs):
+        ports = chunk[0].astype(numpy.int64)
+        histogram += numpy.bincount(ports[(ports >= 0) & (ports < 65536)], minlength=65536)
+    return histogram
+
+
+def conversation_matrix(connection: sqlite3.Connection, n: int = 20, src_column: str = 'src_ip', dest_column: str = 'dest_ip', **kwargs) -> tuple:
+    """
+    Counts the packets sent between every pair of the `n` busiest hosts.
+
+    Parameters:
+    - `n` (int): The number of hosts in the matrix, picked by the number of packets they sent and received.
+    - `src_column` (str): The source address column.
+    - `dest_column` (str): The destination address column.
+    - `**kwargs`: Additional keyword arguments passed to `iter_column_chunks()`.
+
+    Returns:
+    - `tuple`: `(hosts, matrix)` where `matrix[i, j]` is the number of packets `hosts[i]` sent to `hosts[j]`.
+    """
+    import numpy
+
+    pair_totals = {}
+    for src_addresses, dest_addresses in iter_column_chunks(connection, [src_column, dest_column], **kwargs):
+        hosts, inverse = numpy.unique(numpy.concatenate([src_addresses, dest_addresses]), return_inverse=True)
+        src_codes, dest_codes = inverse[:len(src_addresses)], inverse[len(src_addresses):]
+        pair_codes, counts = numpy.unique(src_codes.astype(numpy.int64) * len(hosts) + dest_codes, return_counts=True)
+        pairs = zip(hosts[pair_codes // len(hosts)].tolist(), hosts[pair_codes % len(hosts)].tolist())
+        for pair, count in zip(pairs, counts.tolist()):
+            pair_totals[pair] = pair_totals.get(pair, 0) + count
+
+    host_totals = {}
+    for (src_address, dest_address), count in pair_totals.items():
+        host_totals[src_address] = host_totals.get(src_address, 0) + count
+        host_totals[dest_address] = host_totals.get(dest_address, 0) + count
+    hosts = [host for host, total in top_counts(host_totals, n)]
+    host_index = {host: index for index, host in enumerate(hosts)}
+
+    matrix = numpy.zeros((len(hosts), len(hosts)), dtype=numpy.int64)
+    for (src_address, dest_address), count in pair_totals.items():
+        if src_address in host_index and dest_address in host_index:
+            matrix[host_index[src_address], host_index[dest_address]] = count
+    is_blob = src_column in get_blob_columns(connection, kwargs.get('table_name', 'packet_info'))
+    return [unhex_key(host, is_blob) for host in hosts], matrix
+
+
+def packet_rates(connection: sqlite3.Connection, interval: float = 1.0, **kwargs) -> tuple:
+    """
+    Counts the packets captured in every interval. Needs a `capture_timestamp` column.
+
+    Parameters:
+    - `interval` (float): The length of an interval in seconds.
+    - `**kwargs`: Additional keyword arguments passed to `iter_column_chunks()`. Exp: `where='capture_timestamp >= ?', parameters=(start_time,)`.
+
+    Returns:
+    - `tuple`: `(interval_starts, packets_per_second)` arrays with one entry per interval from the first packet to the last, including empty intervals.
+    """
+    import numpy
+
+    if TIMESTAMP_COLUMN not in get_table_columns(connection, kwargs.get('table_name', 'packet_info')):
+        raise ValueError(f'The table has no {TIMESTAMP_COLUMN} column to compute packet rates')
+    totals = {}
+    for chunk in iter_column_chunks(connection, [TIMESTAMP_COLUMN], **kwargs):
+        interval_numbers, counts = numpy.unique(numpy.floor(chunk[0].astype(numpy.float64) / interval).astype(numpy.int64), return_counts=True)
+        merge_counts(totals, interval_numbers, counts)
+    if not totals:
+        return numpy.array([]), numpy.array([])
+
+    first_interval = min(totals)
+    counts = numpy.zeros(max(totals) - first_interval + 1, dtype=numpy.int64)
+    interval_numbers = numpy.fromiter(totals.keys(), dtype=numpy.int64, count=len(totals))
+    counts[interval_numbers - first_interval] = numpy.fromiter(totals.values(), dtype=numpy.int64, count=len(totals))
+    interval_starts = (numpy.arange(len(counts)) + first_interval) * interval
+    return interval_starts, counts / interval
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Summarise the packets stored in the packet_info table.')
+    parser.add_argument('--db', default='packet_storage.db', help='The database file to read.')
+    parser.add_argument('--top', type=int, default=10, help='The number of talkers and ports to show.')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='The number of rows read at a time.')
+    args = parser.parse_args()
+
+    connection = create_connection_to_db(args.db)
+    print('Top talkers:')
+    for address, total in top_talkers(connection, args.top, chunk_size=args.chunk_size):
+        print(f'  {address}: {total}')
+    histogram = port_histogram(connection, chunk_size=args.chunk_size)
+    print('Top destination ports:')
+    for port in histogram.argsort()[::-1][:args.top]:
+        if histogram[port]:
+            print(f'  {port}: {histogram[port]}')
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()